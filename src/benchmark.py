@@ -0,0 +1,179 @@
+# Offline benchmark of the hot paths against the in-memory fake Spotify, for catching performance regressions
+# Each (library size, operation) pair runs in a fresh process with empty caches and its own state directory,
+# and reports the requests it made, its wall time and the process's peak RSS.
+
+# Usage: python benchmark.py [--sizes 1000,10000,100000] [--operations get_playlist_tracks,...]
+#                            [--latency 0.01] [--rate-limit 200] [--json results.json]
+
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_spotify import FakeSpotify, make_audio_features, make_track
+
+OPERATIONS = ['get_playlist_tracks', 'find_duplicates_in_playlists', 'clean_duplicates', 'sort_tracks',
+              'add_tracks_to_cratedigger', 'clean_playlist']
+SAVED_PLAYLISTS = ['Airborne', 'Boost', 'Chill']
+MIX_SIZE = 200  # Tracks per filler playlist, so large libraries also page through the playlist listing
+UNLIMITED_RATE = 1e6  # Client-side rate when the fake does not throttle
+
+# Builds a synthetic library of about `size` tracks spread over playlists shaped like a real user's:
+# three saved playlists, a CRATEDIGGER overlapping them, Discover Weekly, a playlist full of
+# duplicates (exact copies and remastered re-releases) and filler mixes
+def build_library(size, latency=0.0, rate_limit=None, seed=0):
+    rng = random.Random(seed)
+    sp = FakeSpotify(latency=latency, rate_limit=rate_limit)
+    track_ids = []
+    for _ in range(size):
+        track = make_track(rng)
+        track_ids.append(sp.add_track(track, make_audio_features(rng, track)))
+
+    share = size // 5
+    for number, name in enumerate(SAVED_PLAYLISTS):
+        sp.add_playlist(name, track_ids[number * share:(number + 1) * share])
+    # A fifth of CRATEDIGGER is already saved elsewhere, which is what clean_cratedigger removes
+    saved = track_ids[:3 * share]
+    sp.add_playlist('CRATEDIGGER', rng.sample(saved, share // 5) + track_ids[3 * share:4 * share - share // 5])
+    sp.add_playlist('Discover Weekly', rng.sample(track_ids, min(30, size)))
+
+    # One in ten tracks of 'Dupes' is a duplicate: half exact copies, half remasters with another ISRC
+    dupes = track_ids[4 * share:4 * share + share // 2]
+    for original_id in rng.sample(dupes, len(dupes) // 10):
+        if rng.random() < 0.5:
+            dupes.append(original_id)
+        else:
+            original = sp.tracks[original_id]
+            remaster = make_track(rng, f"{original['name']} - Remastered 2011", original['artists'][0]['name'],
+                                  original['duration_ms'] + rng.randrange(-1000, 1000))
+            dupes.append(sp.add_track(remaster, make_audio_features(rng, remaster)))
+    rng.shuffle(dupes)
+    sp.add_playlist('Dupes', dupes)
+
+    for start in range(4 * share + share // 2, size, MIX_SIZE):
+        sp.add_playlist(f"Mix {start // MIX_SIZE}", track_ids[start:start + MIX_SIZE])
+    return sp
+
+# Client side of the fake: every API call goes through a RateLimiter, which waits out and retries 429s as
+# OrpheusSpotify does for the real API. Fixtures and counters are read straight from the fake.
+class LimitedClient:
+    def __init__(self, sp, limiter):
+        self.sp = sp
+        self.limiter = limiter
+
+    def __getattr__(self, name):
+        value = getattr(self.sp, name)
+        if not callable(value):
+            return value
+        return lambda *args, **kwargs: self.limiter.call(value, *args, **kwargs)
+
+def playlist_named(sp, name):
+    return next(playlist for playlist in sp.playlists.values() if playlist['name'] == name)
+
+# Runs one operation the way the scripts do and returns a short description of its result
+def run_operation(sp, operation):
+    # Imported here so the child's state directory is set before the modules read it
+    import clean_cratedigger
+    import clean_playlist
+    import cratedigger
+    import sort
+    import true_duplicates
+    from playlist_cache import get_playlist_snapshot, get_playlist_tracks
+
+    if operation == 'get_playlist_tracks':
+        playlist_id = playlist_named(sp, 'Airborne')['id']
+        tracks = get_playlist_tracks(sp, playlist_id, get_playlist_snapshot(sp, playlist_id))
+        return f"{len(tracks)} tracks"
+    if operation == 'find_duplicates_in_playlists':
+        cratedigger_ids = {track_id for added_at, track_id in playlist_named(sp, 'CRATEDIGGER')['items']}
+        duplicates = clean_cratedigger.find_duplicates_in_playlists(sp, cratedigger_ids, SAVED_PLAYLISTS)
+        return f"{len(duplicates)} duplicates"
+    if operation == 'sort_tracks':
+        playlist_id = playlist_named(sp, 'Boost')['id']
+        tracks = get_playlist_tracks(sp, playlist_id, get_playlist_snapshot(sp, playlist_id))
+        features = sort.get_audio_features(sp, tracks)
+        sorted_tracks = sort.sort_tracks(tracks, features, sort.parse_sort_keys('energy desc, tempo'))
+        return f"{len(sorted_tracks)} sorted"
+    if operation == 'add_tracks_to_cratedigger':
+        tracks = cratedigger.get_discovery_weekly_tracks(sp)
+        return f"{cratedigger.add_tracks_to_cratedigger(sp, tracks)} added"
+    if operation == 'clean_playlist':
+        removed = clean_playlist.clean_playlist(sp, playlist_named(sp, 'CRATEDIGGER')['id'], SAVED_PLAYLISTS)
+        return f"{removed} removed"
+    if operation == 'clean_duplicates':
+        removed, snapshot_id = true_duplicates.clean_duplicates(sp, playlist_named(sp, 'Dupes')['id'])
+        return f"{removed} removed"
+    raise ValueError(f"Unknown operation: {operation!r}")
+
+# Peak resident set size of this process in MB (ru_maxrss is in KB on Linux and bytes on macOS)
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+# Child process: builds the library, runs one operation and prints its measurements as JSON
+# ru_maxrss is the whole process's high-water mark and the fixture is built in the same process, so the
+# operation's own memory is reported as the growth of that mark past the fixture (operation_rss_mb)
+def run_child(size, operation, latency, rate_limit):
+    from spotify_client import RateLimiter
+    sp = build_library(size, latency, rate_limit)
+    client = LimitedClient(sp, RateLimiter(rate=rate_limit or UNLIMITED_RATE))  # As if ORPHEUS_RATE_LIMIT matched the fake
+    setup_rss = peak_rss_mb()
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')  # The scripts print progress for every track
+    try:
+        started = time.perf_counter()
+        result = run_operation(client, operation)
+        elapsed = time.perf_counter() - started
+    finally:
+        sys.stdout = stdout
+    print(json.dumps({'size': size, 'operation': operation, 'result': result, 'requests': sp.request_count(),
+                      'throttled': sp.throttled_count, 'bytes': sp.bytes_sent, 'seconds': round(elapsed, 3),
+                      'peak_rss_mb': round(peak_rss_mb(), 1), 'setup_rss_mb': round(setup_rss, 1),
+                      'operation_rss_mb': round(peak_rss_mb() - setup_rss, 1),
+                      'requests_by_endpoint': dict(sp.request_counts)}))
+
+def run_benchmark(size, operation, args):
+    with tempfile.TemporaryDirectory() as state_dir:
+        env = dict(os.environ, ORPHEUS_CACHE_DIR=state_dir)
+        if not args.redis:
+            env['ORPHEUS_REDIS_URL'] = 'redis://localhost:1/0'  # Nothing listens there, so the in-process cache is used
+        command = [sys.executable, os.path.abspath(__file__), '--child', str(size), operation, '--latency', str(args.latency)]
+        if args.rate_limit:
+            command += ['--rate-limit', str(args.rate_limit)]
+        output = subprocess.run(command, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Orpheus against an in-memory fake Spotify.")
+    parser.add_argument('--sizes', default='1000,10000,100000', help="comma-separated library sizes in tracks")
+    parser.add_argument('--operations', default=','.join(OPERATIONS), help="comma-separated operations to run")
+    parser.add_argument('--latency', type=float, default=0.01, help="seconds the fake takes per request")
+    parser.add_argument('--rate-limit', type=int, help="requests per second before the fake answers 429")
+    parser.add_argument('--redis', action='store_true', help="use the Redis cache if one is running")
+    parser.add_argument('--json', help="also write the results to this file, for comparing runs")
+    parser.add_argument('--child', nargs=2, metavar=('SIZE', 'OPERATION'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(int(args.child[0]), args.child[1], args.latency, args.rate_limit)
+        return
+
+    results = []
+    print(f"{'tracks':>8}  {'operation':<30} {'requests':>8} {'429s':>5} {'MB sent':>8} {'seconds':>8} {'setup MB':>9} {'op MB':>7} {'peak RSS MB':>12}  result")
+    for size in [int(size) for size in args.sizes.split(',')]:
+        for operation in args.operations.split(','):
+            result = run_benchmark(size, operation.strip(), args)
+            results.append(result)
+            print(f"{size:>8}  {result['operation']:<30} {result['requests']:>8} {result['throttled']:>5} "
+                  f"{result['bytes'] / 1e6:>8.1f} {result['seconds']:>8.2f} {result['setup_rss_mb']:>9.1f} {result['operation_rss_mb']:>7.1f} {result['peak_rss_mb']:>12.1f}  {result['result']}")
+    if args.json:
+        with open(args.json, 'w') as results_file:
+            json.dump(results, results_file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,82 @@
 # Creates CRATEDIGGER if not created already and adds songs from 'Discovery weekly' to it
 
+import json
 import os
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
 
-def get_discovery_weekly_tracks(sp):
-    for playlist in sp.current_user_playlists()['items']:
+from playlist_cache import CACHE_DIR, get_playlist_tracks, get_user_playlists
+from spotify_client import authenticate_spotify
+from tracing import stage
+
+# CRATEDIGGER's ID, the snapshot we last saw and the URIs it holds, so weekly runs only need a diff
+STATE_PATH = os.getenv('ORPHEUS_CRATEDIGGER_STATE', os.path.join(CACHE_DIR, 'cratedigger.json'))
+
+def load_state():
+    try:
+        with open(STATE_PATH) as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError):
+        return {}
+
+def save_state(state):
+    os.makedirs(os.path.dirname(os.path.abspath(STATE_PATH)), exist_ok=True)
+    temporary_path = STATE_PATH + '.tmp'
+    with open(temporary_path, 'w') as state_file:
+        json.dump(state, state_file)
+    os.replace(temporary_path, STATE_PATH)  # Atomic, so a crash mid-write never forces CRATEDIGGER to be read again
+
+# Listing the playlists is skipped when a fresh listing is passed in
+def get_discovery_weekly_tracks(sp, playlists=None):
+    for playlist in playlists if playlists is not None else get_user_playlists(sp):
         if playlist['name'] == 'Discover Weekly':
-            discovery_weekly_id = playlist['id']
-            results = sp.playlist_tracks(discovery_weekly_id)
-            tracks = results['items']
-            while results['next']:
-                results = sp.next(results)
-                tracks.extend(results['items'])
-            return tracks
+            return get_playlist_tracks(sp, playlist['id'], playlist['snapshot_id'])
     return []
 
-def add_tracks_to_cratedigger(sp, tracks):
-    cratedigger_id = None
-    for playlist in sp.current_user_playlists()['items']:
+# Returns CRATEDIGGER's ID and current snapshot_id, using the cached ID while the user still follows it
+# Deleting a playlist on Spotify only unfollows it and its ID keeps resolving, so the cached ID is trusted only
+# when it is in the user's playlist listing; otherwise CRATEDIGGER is looked up by name, or created
+def resolve_cratedigger(sp, state, playlists=None):
+    if playlists is None:
+        playlists = get_user_playlists(sp)
+    for playlist in playlists:
+        if playlist['id'] == state.get('playlist_id'):
+            return playlist['id'], playlist['snapshot_id']
+    for playlist in playlists:
         if playlist['name'] == 'CRATEDIGGER':
-            cratedigger_id = playlist['id']
-            break
-    if not cratedigger_id:
-        user_id = sp.current_user()['id']
-        cratedigger = sp.user_playlist_create(user_id, 'CRATEDIGGER', public=False)
-        cratedigger_id = cratedigger['id']
+            return playlist['id'], playlist['snapshot_id']
+    user_id = sp.current_user()['id']
+    cratedigger = sp.user_playlist_create(user_id, 'CRATEDIGGER', public=False)
+    return cratedigger['id'], cratedigger['snapshot_id']
+
+# Adds the tracks not yet in CRATEDIGGER, 100 per request, and returns how many were added
+# Running it twice with the same tracks adds nothing the second time
+def add_tracks_to_cratedigger(sp, tracks, playlists=None):
+    state = load_state()
+    cratedigger_id, snapshot_id = resolve_cratedigger(sp, state, playlists)
+    if state.get('playlist_id') != cratedigger_id or state.get('snapshot_id') != snapshot_id:
+        # CRATEDIGGER changed outside this script (or is new), so its URIs are read again
+        state = {'playlist_id': cratedigger_id, 'uris': [track.uri for track in
+                                                         get_playlist_tracks(sp, cratedigger_id, snapshot_id) if track.uri]}
+    known_uris = set(state['uris'])
+
+    track_uris = [track.uri for track in tracks if track.id]
+    new_uris = [uri for uri in dict.fromkeys(track_uris) if uri not in known_uris]
+    with stage('add tracks'):
+        for i in range(0, len(new_uris), 100):
+            result = sp.playlist_add_items(cratedigger_id, new_uris[i:i + 100])
+            snapshot_id = result['snapshot_id']
 
-    track_uris = [track['track']['uri'] for track in tracks]
-    sp.playlist_add_items(cratedigger_id, track_uris)
+    state['uris'].extend(new_uris)
+    state['snapshot_id'] = snapshot_id  # Our own additions don't force a re-read next week
+    save_state(state)
+    return len(new_uris)
 
 if __name__ == "__main__":
-    sp = spotipy.Spotify(auth_manager=SpotifyOAuth(
-        client_id=os.getenv('SPOTIFY_CLIENT_ID'),
-        client_secret=os.getenv('SPOTIFY_CLIENT_SECRET'),
-        redirect_uri='http://127.0.0.1:5000',
-        scope="playlist-modify-private,playlist-read-private"))
+    sp = authenticate_spotify()
 
-    tracks = get_discovery_weekly_tracks(sp)
+    playlists = get_user_playlists(sp)  # Listed once for both Discover Weekly and CRATEDIGGER
+    tracks = get_discovery_weekly_tracks(sp, playlists)
     if tracks:
-        add_tracks_to_cratedigger(sp, tracks)
-        print(f"Added {len(tracks)} tracks to CRATEDIGGER.")
+        added = add_tracks_to_cratedigger(sp, tracks, playlists)
+        print(f"Added {added} new tracks to CRATEDIGGER.")
     else:
         print("No tracks found in Discovery Weekly.")
@@ -0,0 +1,295 @@
+# In-memory stand-in for the Spotify Web API, for running the scripts offline and benchmarking them
+# Implements the spotipy.Spotify methods the scripts use, including Spotify's offset paging, the `fields`
+# filter, snapshot_ids that change on every write, per-request limits and 429 throttling with Retry-After.
+# Responses go through a JSON round trip like real ones, so callers never share objects with the fake.
+
+import json
+import random
+import string
+import threading
+import time
+from collections import Counter, deque
+from urllib.parse import parse_qs, urlparse
+
+from spotipy import SpotifyException
+
+# Market codes attached to every track and album, as the real API does
+MARKETS = ['AD', 'AE', 'AR', 'AT', 'AU', 'BE', 'BG', 'BO', 'BR', 'CA', 'CH', 'CL', 'CO', 'CR', 'CY', 'CZ',
+           'DE', 'DK', 'DO', 'EC', 'EE', 'EG', 'ES', 'FI', 'FR', 'GB', 'GR', 'GT', 'HK', 'HN', 'HU', 'ID',
+           'IE', 'IL', 'IN', 'IS', 'IT', 'JO', 'JP', 'KW', 'LB', 'LI', 'LT', 'LU', 'LV', 'MA', 'MC', 'MT',
+           'MX', 'MY', 'NI', 'NL', 'NO', 'NZ', 'OM', 'PA', 'PE', 'PH', 'PL', 'PS', 'PT', 'PY', 'QA', 'RO',
+           'SA', 'SE', 'SG', 'SK', 'SV', 'TH', 'TN', 'TR', 'TW', 'US', 'UY', 'VN', 'ZA', 'KR', 'RS', 'UA']
+MAX_ITEMS_PER_REQUEST = 100
+MAX_PLAYLIST_PAGE = 100
+MAX_PLAYLISTS_PAGE = 50
+
+# Parses a Spotify `fields` expression such as "items(track(id,artists(name))),next" into a nested dict
+def parse_fields(fields):
+    tree, stack, name = {}, [], ''
+    current = tree
+    for char in fields + ',':
+        if char == '(':
+            current[name.strip()] = {}
+            stack.append(current)
+            current, name = current[name.strip()], ''
+        elif char in ',)':
+            if name.strip():
+                current[name.strip()] = None  # None keeps the whole value
+            name = ''
+            if char == ')':
+                current = stack.pop()
+        else:
+            name += char
+    return tree
+
+# Keeps only the parts of a response selected by a parsed fields tree
+def filter_fields(value, tree):
+    if tree is None:
+        return value
+    if isinstance(value, list):
+        return [filter_fields(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {key: filter_fields(value[key], subtree) for key, subtree in tree.items() if key in value}
+    return value
+
+def random_id(rng):
+    return ''.join(rng.choice(string.ascii_letters + string.digits) for _ in range(22))
+
+# Builds a full track object shaped like the Web API's, with album art, markets and external URLs
+def make_track(rng, name=None, artist=None, duration_ms=None, isrc=None):
+    track_id, album_id, artist_id = random_id(rng), random_id(rng), random_id(rng)
+    artist = artist or f"Artist {rng.randrange(5000)}"
+    artist_object = {'external_urls': {'spotify': f'https://open.spotify.com/artist/{artist_id}'},
+                     'href': f'https://api.spotify.com/v1/artists/{artist_id}', 'id': artist_id,
+                     'name': artist, 'type': 'artist', 'uri': f'spotify:artist:{artist_id}'}
+    images = [{'height': size, 'url': f'https://i.scdn.co/image/{random_id(rng)}', 'width': size} for size in (640, 300, 64)]
+    return {
+        'album': {'album_type': 'album', 'artists': [artist_object], 'available_markets': MARKETS,
+                  'external_urls': {'spotify': f'https://open.spotify.com/album/{album_id}'},
+                  'href': f'https://api.spotify.com/v1/albums/{album_id}', 'id': album_id, 'images': images,
+                  'name': f"Album {rng.randrange(100000)}", 'release_date': f'{rng.randrange(1960, 2024)}-01-01',
+                  'release_date_precision': 'day', 'total_tracks': 12, 'type': 'album', 'uri': f'spotify:album:{album_id}'},
+        'artists': [artist_object], 'available_markets': MARKETS, 'disc_number': 1,
+        'duration_ms': duration_ms or rng.randrange(120000, 360000), 'explicit': rng.random() < 0.2,
+        'external_ids': {'isrc': isrc or f"US{random_id(rng)[:10].upper()}"},
+        'external_urls': {'spotify': f'https://open.spotify.com/track/{track_id}'},
+        'href': f'https://api.spotify.com/v1/tracks/{track_id}', 'id': track_id, 'is_local': False,
+        'name': name or f"Song {rng.randrange(10 ** 6)}", 'popularity': rng.randrange(101),
+        'preview_url': f'https://p.scdn.co/mp3-preview/{random_id(rng)}', 'track_number': rng.randrange(1, 13),
+        'type': 'track', 'uri': f'spotify:track:{track_id}',
+    }
+
+# Builds an audio features object for a track
+def make_audio_features(rng, track):
+    return {'danceability': rng.random(), 'energy': rng.random(), 'key': rng.randrange(12),
+            'loudness': -rng.random() * 20, 'mode': rng.randrange(2), 'speechiness': rng.random() / 4,
+            'acousticness': rng.random(), 'instrumentalness': rng.random() / 2, 'liveness': rng.random() / 2,
+            'valence': rng.random(), 'tempo': rng.uniform(70, 180), 'type': 'audio_features', 'id': track['id'],
+            'uri': track['uri'], 'track_href': track['href'], 'analysis_url': f"https://api.spotify.com/v1/audio-analysis/{track['id']}",
+            'duration_ms': track['duration_ms'], 'time_signature': 4}
+
+class FakeSpotify:
+    def __init__(self, user_id='orpheus-user', latency=0.0, rate_limit=None, retry_after=1):
+        self.user_id = user_id
+        self.latency = latency  # Seconds each request takes, slept outside the lock so concurrency pays off
+        self.rate_limit = rate_limit  # Requests allowed per rolling second before answering 429, None for no limit
+        self.retry_after = retry_after  # Seconds sent in the Retry-After header of a 429
+        self.tracks = {}  # track ID -> track object
+        self.audio_features_by_id = {}  # track ID -> audio features object
+        self.playlists = {}  # playlist ID -> {'id', 'name', 'public', 'version', 'items': [(added_at, track ID)]}
+        self.request_counts = Counter()  # endpoint -> requests answered, throttled ones included
+        self.throttled_count = 0
+        self.bytes_sent = 0  # JSON bytes of every response
+        self.lock = threading.Lock()
+        self.recent_requests = deque()  # Timestamps of the requests in the current rate limit window
+
+    # Fixture helpers, not part of the API
+
+    def add_track(self, track, audio_features=None):
+        self.tracks[track['id']] = track
+        if audio_features:
+            self.audio_features_by_id[track['id']] = audio_features
+        return track['id']
+
+    def add_playlist(self, name, track_ids, public=False):
+        playlist_id = random_id(random.Random(len(self.playlists)))
+        self.playlists[playlist_id] = {'id': playlist_id, 'name': name, 'public': public, 'version': 0,
+                                       'items': [('2024-01-01T00:00:00Z', track_id) for track_id in track_ids]}
+        return playlist_id
+
+    def request_count(self):
+        return sum(self.request_counts.values())
+
+    # Request plumbing
+
+    def _request(self, endpoint, build_response):
+        with self.lock:
+            self.request_counts[endpoint] += 1
+            if self.rate_limit:
+                now = time.monotonic()
+                while self.recent_requests and now - self.recent_requests[0] >= 1:
+                    self.recent_requests.popleft()
+                if len(self.recent_requests) >= self.rate_limit:
+                    self.throttled_count += 1
+                    raise SpotifyException(429, -1, 'API rate limit exceeded', headers={'Retry-After': str(self.retry_after)})
+                self.recent_requests.append(now)
+            body = json.dumps(build_response())  # Built under the lock so every response is consistent
+            self.bytes_sent += len(body)
+        if self.latency:
+            time.sleep(self.latency)
+        return json.loads(body)
+
+    def _playlist(self, playlist_id):
+        playlist = self.playlists.get(self._id(playlist_id))
+        if playlist is None:
+            raise SpotifyException(404, -1, 'Not found.')
+        return playlist
+
+    @staticmethod
+    def _id(value):
+        return value.rsplit(':', 1)[-1].rsplit('/', 1)[-1]
+
+    @staticmethod
+    def _check_batch(items):
+        if len(items) > MAX_ITEMS_PER_REQUEST:
+            raise SpotifyException(400, -1, f'Too many ids requested, max {MAX_ITEMS_PER_REQUEST}')
+
+    def _snapshot(self, playlist):
+        return f"{playlist['id']}-{playlist['version']}"
+
+    def _changed(self, playlist):
+        playlist['version'] += 1
+        return {'snapshot_id': self._snapshot(playlist)}
+
+    def _simplified_playlist(self, playlist):
+        return {'collaborative': False, 'description': '', 'href': f"https://api.spotify.com/v1/playlists/{playlist['id']}",
+                'id': playlist['id'], 'name': playlist['name'], 'owner': {'id': self.user_id, 'type': 'user'},
+                'public': playlist['public'], 'snapshot_id': self._snapshot(playlist),
+                'tracks': {'total': len(playlist['items'])}, 'type': 'playlist', 'uri': f"spotify:playlist:{playlist['id']}"}
+
+    def _page(self, url, items, total, limit, offset, extra_query=''):
+        following = offset + limit
+        return {'href': f'{url}?offset={offset}&limit={limit}{extra_query}', 'items': items, 'limit': limit,
+                'next': f'{url}?offset={following}&limit={limit}{extra_query}' if following < total else None,
+                'offset': offset, 'previous': f'{url}?offset={max(offset - limit, 0)}&limit={limit}{extra_query}' if offset else None,
+                'total': total}
+
+    # Read endpoints
+
+    def current_user(self):
+        return self._request('me', lambda: {'id': self.user_id, 'type': 'user'})
+
+    me = current_user
+
+    def current_user_playlists(self, limit=50, offset=0):
+        def build():
+            if limit > MAX_PLAYLISTS_PAGE:
+                raise SpotifyException(400, -1, 'Invalid limit')
+            playlists = list(self.playlists.values())
+            items = [self._simplified_playlist(playlist) for playlist in playlists[offset:offset + limit]]
+            return self._page('https://api.spotify.com/v1/me/playlists', items, len(playlists), limit, offset)
+        return self._request('me/playlists', build)
+
+    def user_playlists(self, user, limit=50, offset=0):
+        return self.current_user_playlists(limit, offset)
+
+    def playlist(self, playlist_id, fields=None, market=None, additional_types=('track',)):
+        def build():
+            playlist = self._playlist(playlist_id)
+            response = self._simplified_playlist(playlist)
+            return filter_fields(response, parse_fields(fields)) if fields else response
+        return self._request('playlists/{id}', build)
+
+    def playlist_items(self, playlist_id, fields=None, limit=100, offset=0, market=None, additional_types=('track', 'episode')):
+        def build():
+            if limit > MAX_PLAYLIST_PAGE:
+                raise SpotifyException(400, -1, 'Invalid limit')
+            playlist = self._playlist(playlist_id)
+            items = [{'added_at': added_at, 'added_by': {'id': self.user_id, 'type': 'user'}, 'is_local': False,
+                      'primary_color': None, 'track': self.tracks.get(track_id), 'video_thumbnail': {'url': None}}
+                     for added_at, track_id in playlist['items'][offset:offset + limit]]
+            url = f"https://api.spotify.com/v1/playlists/{playlist['id']}/tracks"
+            page = self._page(url, items, len(playlist['items']), limit, offset, f'&fields={fields}' if fields else '')
+            return filter_fields(page, parse_fields(fields)) if fields else page
+        return self._request('playlists/{id}/tracks', build)
+
+    playlist_tracks = playlist_items
+
+    def next(self, result):
+        if not result.get('next'):
+            return None
+        url = urlparse(result['next'])
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        limit, offset = int(query.get('limit', 50)), int(query.get('offset', 0))
+        if url.path.endswith('/tracks'):
+            return self.playlist_items(url.path.split('/')[-2], query.get('fields'), limit, offset)
+        return self.current_user_playlists(limit, offset)
+
+    def audio_features(self, tracks=[]):
+        def build():
+            self._check_batch(tracks)
+            return {'audio_features': [self.audio_features_by_id.get(self._id(track)) for track in tracks]}
+        return self._request('audio-features', build)['audio_features']
+
+    # Write endpoints
+
+    def user_playlist_create(self, user, name, public=True, collaborative=False, description=''):
+        def build():
+            playlist_id = self.add_playlist(name, [], public)
+            return self._simplified_playlist(self.playlists[playlist_id])
+        return self._request('users/{id}/playlists', build)
+
+    def playlist_add_items(self, playlist_id, items, position=None):
+        def build():
+            self._check_batch(items)
+            playlist = self._playlist(playlist_id)
+            new_items = [('2024-06-01T00:00:00Z', self._id(item)) for item in items]
+            index = len(playlist['items']) if position is None else position
+            playlist['items'][index:index] = new_items
+            return self._changed(playlist)
+        return self._request('playlists/{id}/tracks POST', build)
+
+    def playlist_replace_items(self, playlist_id, items):
+        def build():
+            self._check_batch(items)
+            playlist = self._playlist(playlist_id)
+            playlist['items'] = [('2024-06-01T00:00:00Z', self._id(item)) for item in items]
+            return self._changed(playlist)
+        return self._request('playlists/{id}/tracks PUT', build)
+
+    def playlist_reorder_items(self, playlist_id, range_start, insert_before, range_length=1, snapshot_id=None):
+        def build():
+            playlist = self._playlist(playlist_id)
+            items = playlist['items']
+            if range_start + range_length > len(items) or insert_before > len(items):
+                raise SpotifyException(400, -1, 'Index out of bounds')
+            block = items[range_start:range_start + range_length]
+            del items[range_start:range_start + range_length]
+            new_start = insert_before if insert_before < range_start else insert_before - range_length
+            items[new_start:new_start] = block
+            return self._changed(playlist)
+        return self._request('playlists/{id}/tracks PUT', build)
+
+    def playlist_remove_all_occurrences_of_items(self, playlist_id, items, snapshot_id=None):
+        def build():
+            self._check_batch(items)
+            playlist = self._playlist(playlist_id)
+            removed = {self._id(item) for item in items}
+            playlist['items'] = [item for item in playlist['items'] if item[1] not in removed]
+            return self._changed(playlist)
+        return self._request('playlists/{id}/tracks DELETE', build)
+
+    # Positions are checked against the current playlist; callers that chain snapshot_ids see the same result
+    def playlist_remove_specific_occurrences_of_items(self, playlist_id, items, snapshot_id=None):
+        def build():
+            self._check_batch(items)
+            playlist = self._playlist(playlist_id)
+            positions = set()
+            for item in items:
+                for position in item['positions']:
+                    if position >= len(playlist['items']) or playlist['items'][position][1] != self._id(item['uri']):
+                        raise SpotifyException(400, -1, 'Could not remove tracks, please check parameters.')
+                    positions.add(position)
+            playlist['items'] = [item for position, item in enumerate(playlist['items']) if position not in positions]
+            return self._changed(playlist)
+        return self._request('playlists/{id}/tracks DELETE', build)
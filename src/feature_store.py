@@ -0,0 +1,98 @@
+# Persistent local store of Spotify audio features, keyed by track ID
+# A track's audio features never change, so each track only ever needs to be fetched once
+
+# Usage: python feature_store.py export features.csv
+#        python feature_store.py import features.csv
+
+import csv
+import os
+import sqlite3
+import sys
+
+from playlist_cache import CACHE_DIR
+
+# Numeric audio features kept for every track, in the order of the table columns
+FEATURE_COLUMNS = (
+    'danceability', 'energy', 'key', 'loudness', 'mode', 'speechiness', 'acousticness',
+    'instrumentalness', 'liveness', 'valence', 'tempo', 'duration_ms', 'time_signature'
+)
+STORE_PATH = os.getenv('ORPHEUS_FEATURE_STORE', os.path.join(CACHE_DIR, 'audio_features.db'))
+QUERY_CHUNK = 500  # Track IDs looked up per query, below SQLite's bound parameter limit
+
+class FeatureStore:
+    def __init__(self, path=STORE_PATH):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        columns = ', '.join(f'{column} REAL' for column in FEATURE_COLUMNS)
+        # A row whose columns are all NULL marks a track Spotify has no features for, so it is not asked again
+        self.connection.execute(f'CREATE TABLE IF NOT EXISTS audio_features (id TEXT PRIMARY KEY, {columns})')
+
+    # Returns {track_id: feature dict} for the stored tracks; tracks known to have no features map to None
+    def get_many(self, track_ids):
+        found = {}
+        track_ids = list(track_ids)
+        for i in range(0, len(track_ids), QUERY_CHUNK):
+            chunk = track_ids[i:i + QUERY_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.connection.execute(
+                f'SELECT id, {", ".join(FEATURE_COLUMNS)} FROM audio_features WHERE id IN ({placeholders})', chunk)
+            for row in rows:
+                found[row[0]] = self._to_features(row)
+        return found
+
+    # Stores Spotify audio feature payloads; a None payload records that the track has no features
+    def put_many(self, track_ids, features_list):
+        rows = []
+        for track_id, features in zip(track_ids, features_list):
+            values = [features.get(column) if features else None for column in FEATURE_COLUMNS]
+            rows.append([track_id] + values)
+        self._insert(rows)
+
+    # Loads features from a CSV file with an 'id' column followed by the feature columns
+    def import_csv(self, path):
+        with open(path, newline='') as csv_file:
+            reader = csv.DictReader(csv_file)
+            rows = [[row['id']] + [float(row[column]) if row.get(column) not in (None, '') else None
+                                   for column in FEATURE_COLUMNS] for row in reader]
+        self._insert(rows)
+        return len(rows)
+
+    # Writes every stored track to a CSV file in the format read by import_csv
+    def export_csv(self, path):
+        rows = self.connection.execute(f'SELECT id, {", ".join(FEATURE_COLUMNS)} FROM audio_features ORDER BY id')
+        count = 0
+        with open(path, 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(('id',) + FEATURE_COLUMNS)
+            for row in rows:
+                writer.writerow(['' if value is None else value for value in row])
+                count += 1
+        return count
+
+    def close(self):
+        self.connection.close()
+
+    def _insert(self, rows):
+        placeholders = ','.join('?' * (len(FEATURE_COLUMNS) + 1))
+        with self.connection:  # One transaction for the whole batch
+            self.connection.executemany(f'INSERT OR REPLACE INTO audio_features VALUES ({placeholders})', rows)
+
+    @staticmethod
+    def _to_features(row):
+        if all(value is None for value in row[1:]):
+            return None
+        features = dict(zip(FEATURE_COLUMNS, row[1:]))
+        features['id'] = row[0]
+        return features
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in ('import', 'export'):
+        print("Usage: python feature_store.py import|export <file.csv>")
+        sys.exit(1)
+    store = FeatureStore()
+    if sys.argv[1] == 'import':
+        print(f"Imported audio features for {store.import_csv(sys.argv[2])} tracks into {STORE_PATH}.")
+    else:
+        print(f"Exported audio features for {store.export_csv(sys.argv[2])} tracks to {sys.argv[2]}.")
+    store.close()
@@ -0,0 +1,134 @@
+# Library-wide index of where every track appears across the user's playlists
+# Built once from all playlists, then updated incrementally: only playlists whose snapshot_id changed are fetched
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from matching import normalize_key
+from pagination import MAX_CONCURRENCY
+from playlist_cache import CACHE_DIR, get_playlist_tracks, get_user_playlists
+from tracing import propagate, stage
+from track_record import Track
+
+INDEX_PATH = os.getenv('ORPHEUS_LIBRARY_INDEX', os.path.join(CACHE_DIR, 'library_index.json'))
+INDEX_VERSION = 2  # Bumped whenever the saved keys or entries change shape (v2: entries hold Track rows)
+
+class LibraryIndex:
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self.playlists = {}  # playlist_id -> {'name', 'snapshot_id', 'entries': [(key, Track), ...] by position}
+        self.by_key = {}  # (title, artist) key -> {playlist_id: [positions]}
+        self.by_isrc = {}  # ISRC -> {playlist_id: [positions]}
+        self.by_id = {}  # track ID -> {playlist IDs}
+
+    # Loads a previously saved index; a missing, unreadable or outdated file gives an empty index
+    # Outdated files are discarded whole: refresh() only re-fetches changed playlists, so keys in another
+    # format would otherwise linger for every unchanged playlist and never match
+    @classmethod
+    def load(cls, path=INDEX_PATH):
+        index = cls(path)
+        try:
+            with open(path) as index_file:
+                saved = json.load(index_file)
+        except (OSError, ValueError):
+            return index
+        if not isinstance(saved, dict) or saved.get('version') != INDEX_VERSION:
+            return index
+        for playlist_id, playlist in saved['playlists'].items():
+            entries = [(tuple(key), Track.from_row(row)) if key else (None, None) for key, row in playlist['entries']]
+            index._add_playlist(playlist_id, playlist['name'], playlist['snapshot_id'], entries)
+        return index
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        playlists = {playlist_id: dict(playlist, entries=[(key, track.to_row() if track else None) for key, track in playlist['entries']])
+                     for playlist_id, playlist in self.playlists.items()}
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as index_file:
+            json.dump({'version': INDEX_VERSION, 'playlists': playlists}, index_file)
+        os.replace(temporary_path, self.path)  # Atomic, so a crash mid-write never forces a full rebuild
+
+    # Brings the index up to date with the user's playlists and returns the number of playlists re-fetched
+    # Listing the playlists costs one call per 50 playlists (skipped when a fresh listing is passed in);
+    # only new or changed playlists are downloaded
+    def refresh(self, sp, playlists=None, max_workers=MAX_CONCURRENCY):
+        if playlists is None:
+            playlists = get_user_playlists(sp)
+        listed = {playlist['id']: playlist for playlist in playlists if playlist}
+        for playlist_id in set(self.playlists) - set(listed):
+            self._remove_playlist(playlist_id)  # Deleted or unfollowed playlists
+        for playlist_id, playlist in listed.items():
+            if playlist_id in self.playlists:
+                self.playlists[playlist_id]['name'] = playlist['name']  # Renames don't change the snapshot
+
+        changed = [playlist for playlist_id, playlist in listed.items()
+                   if self.playlists.get(playlist_id, {}).get('snapshot_id') != playlist['snapshot_id']]
+        if changed:
+            # Playlists are downloaded in parallel, each one paged sequentially to keep the total bounded
+            with stage('index refresh'), ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(changed)))) as pool:
+                fetched = pool.map(propagate(lambda playlist: get_playlist_tracks(sp, playlist['id'], playlist['snapshot_id'], max_workers=1)), changed)
+                for playlist, tracks in zip(changed, fetched):
+                    self._remove_playlist(playlist['id'])
+                    entries = [(normalize_key(track), track) if track.uri else (None, None) for track in tracks]
+                    self._add_playlist(playlist['id'], playlist['name'], playlist['snapshot_id'], entries)
+            self.save()
+        return len(changed)
+
+    # IDs of the indexed playlists with one of the given names
+    def playlist_ids_named(self, playlist_names):
+        names = {name.strip().lower() for name in playlist_names}
+        return {playlist_id for playlist_id, playlist in self.playlists.items() if playlist['name'].lower() in names}
+
+    # Returns the tracks in the given playlists that share the track's normalized key or ISRC, the candidates
+    # find_saved_copy compares it with
+    def saved_copies(self, track, playlist_ids):
+        copies = []
+        for table, value in ((self.by_key, normalize_key(track)), (self.by_isrc, track.isrc)):
+            if not value:
+                continue
+            for playlist_id, positions in table.get(value, {}).items():
+                if playlist_id in playlist_ids:
+                    entries = self.playlists[playlist_id]['entries']
+                    copies.extend(entries[position][1] for position in positions)
+        return copies
+
+    # Returns the subset of track IDs that appear in any of the given playlists
+    def track_ids_in_playlists(self, track_ids, playlist_ids):
+        return {track_id for track_id in track_ids if not playlist_ids.isdisjoint(self.by_id.get(track_id, ()))}
+
+    def _add_playlist(self, playlist_id, name, snapshot_id, entries):
+        self.playlists[playlist_id] = {'name': name, 'snapshot_id': snapshot_id, 'entries': entries}
+        for position, (key, track) in enumerate(entries):
+            if key is None:
+                continue  # Unavailable tracks
+            self.by_key.setdefault(key, {}).setdefault(playlist_id, []).append(position)
+            if track.isrc:
+                self.by_isrc.setdefault(track.isrc, {}).setdefault(playlist_id, []).append(position)
+            if track.id:
+                self.by_id.setdefault(track.id, set()).add(playlist_id)
+
+    def _remove_playlist(self, playlist_id):
+        playlist = self.playlists.pop(playlist_id, None)
+        if playlist is None:
+            return
+        for key, track in playlist['entries']:
+            if key is None:
+                continue
+            for table, value in ((self.by_key, key), (self.by_isrc, track.isrc)):
+                locations = table.get(value)
+                if locations and playlist_id in locations:
+                    del locations[playlist_id]
+                    if not locations:
+                        del table[value]
+            playlist_ids = self.by_id.get(track.id)
+            if playlist_ids:
+                playlist_ids.discard(playlist_id)
+                if not playlist_ids:
+                    del self.by_id[track.id]
+
+# Loads the saved index and brings it up to date in one step
+def load_library_index(sp):
+    index = LibraryIndex.load()
+    index.refresh(sp)
+    return index
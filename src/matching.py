@@ -0,0 +1,88 @@
+# Fuzzy "true duplicate" matching: normalized titles, ISRC blocking and duration tolerance
+
+import re
+import unicodedata
+from collections import namedtuple
+
+DURATION_TOLERANCE_MS = 3000  # Largest length difference still considered the same recording
+
+# Suffix words that mark a re-release or alternate version of the same song rather than a different song
+VERSION_WORDS = r'(?:remaster(?:ed)?|feat\.?|ft\.?|featuring|with|version|edit|mono|stereo|deluxe|bonus|single|explicit|clean)'
+BRACKETED_SUFFIX = re.compile(r'\s*[(\[][^)\]]*\b' + VERSION_WORDS + r'\b[^)\]]*[)\]]')  # "(feat. X)", "[2011 Remaster]"
+DASH_SUFFIX = re.compile(r'\s+-\s+.*\b' + VERSION_WORDS + r'\b.*$')  # "- Remastered 2011", "- Radio Edit"
+APOSTROPHES = re.compile(r"['\u2019]")  # Dropped outright so "don't" and "dont" fold together
+PUNCTUATION = re.compile(r'[^\w\s]')
+
+# One duplicate found by iter_duplicates: the copy at `position` would be removed in favour of `keep_position`
+DuplicateMatch = namedtuple('DuplicateMatch', ['position', 'keep_position', 'confidence', 'reason'])
+
+# Folds case and accents ("Beyoncé" -> "beyonce") and collapses punctuation and whitespace
+def fold_text(text):
+    decomposed = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+    return ' '.join(PUNCTUATION.sub(' ', APOSTROPHES.sub('', text)).split())
+
+# Normalizes a track title by dropping remaster, feature and version suffixes before folding it
+def normalize_title(title):
+    title = BRACKETED_SUFFIX.sub('', title.casefold())
+    title = DASH_SUFFIX.sub('', title)
+    return fold_text(title)
+
+# Normalized (title, primary artist) key used to recognize the same song across playlists
+def normalize_key(track):
+    return (normalize_title(track.name), fold_text(track.artist) if track.artist else '')
+
+# Returns (confidence, reason) when candidate is a duplicate of kept, otherwise None
+def match_confidence(kept, candidate, duration_tolerance_ms=DURATION_TOLERANCE_MS):
+    if kept.uri == candidate.uri:
+        return 1.0, 'same track'
+    if kept.isrc and kept.isrc == candidate.isrc:
+        return 0.99, 'same ISRC'
+    if normalize_key(kept) != normalize_key(candidate):
+        return None
+    if kept.duration_ms is None or candidate.duration_ms is None:
+        difference = duration_tolerance_ms  # Unknown length counts as the largest tolerated difference
+    else:
+        difference = abs(kept.duration_ms - candidate.duration_ms)
+    if difference > duration_tolerance_ms:
+        return None  # Same title but a different recording (live take, extended mix, ...)
+    if fold_text(kept.name) == fold_text(candidate.name):
+        confidence, reason = 0.95, 'same title and artist'
+    else:
+        confidence, reason = 0.85, 'same title after removing version suffixes'
+    return round(confidence - 0.15 * difference / duration_tolerance_ms, 2), reason
+
+# Returns (confidence, reason, saved track) for the closest copy of track among candidate saved tracks
+# (see LibraryIndex.saved_copies), or None when none of them is the same recording
+def find_saved_copy(track, candidates, duration_tolerance_ms=DURATION_TOLERANCE_MS):
+    best = None
+    for saved in candidates:
+        result = match_confidence(saved, track, duration_tolerance_ms)
+        if result and (best is None or result[0] > best[0]):
+            best = result + (saved,)
+    return best
+
+# Finds duplicate tracks in a playlist: consumes (position, track) pairs in playlist order and yields
+# (DuplicateMatch, track) for every copy that would be removed, as soon as it is recognized
+# Tracks are grouped by ISRC and by normalized key, and only compared with the kept copies in their own
+# groups, so the work stays close to O(n) even for very large libraries. The earliest copy is kept.
+def iter_duplicates(tracks, duration_tolerance_ms=DURATION_TOLERANCE_MS, min_confidence=0.0):
+    kept_by_isrc = {}  # ISRC -> (position, track) of kept copies
+    kept_by_key = {}  # normalized key -> (position, track) of kept copies
+    for position, track in tracks:
+        if not track.id:
+            continue  # Local files and unavailable tracks cannot be removed by URI
+        key = normalize_key(track)
+        candidates = kept_by_key.get(key, []) + (kept_by_isrc.get(track.isrc, []) if track.isrc else [])
+
+        best = None
+        for kept_position, kept_track in candidates:
+            result = match_confidence(kept_track, track, duration_tolerance_ms)
+            if result and (best is None or result[0] > best[1]):
+                best = (kept_position,) + result
+        if best and best[1] >= min_confidence:
+            yield DuplicateMatch(position, *best), track
+        else:
+            kept_by_key.setdefault(key, []).append((position, track))  # This copy is kept and compared against later
+            if track.isrc:
+                kept_by_isrc.setdefault(track.isrc, []).append((position, track))
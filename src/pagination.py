@@ -0,0 +1,30 @@
+# Concurrent pagination for Spotify's offset-based paging endpoints
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from tracing import propagate
+
+MAX_CONCURRENCY = int(os.getenv('ORPHEUS_MAX_CONCURRENCY', 8))  # Upper bound on page requests in flight at once
+
+# Fetches every page of a paged endpoint and returns all items in their original order
+# fetch_page(offset) must return one page; the first page's 'total' and 'limit' give every remaining offset,
+# so the rest are requested together through a thread pool bounded by max_workers
+def fetch_all_pages(fetch_page, max_workers=MAX_CONCURRENCY):
+    first_page = fetch_page(0)
+    items = list(first_page['items'])
+    offsets = range(len(first_page['items']), first_page['total'], first_page['limit'])
+    if not first_page['items'] or not offsets:
+        return items  # Everything fit on the first page
+
+    if max_workers <= 1:
+        pages = (fetch_page(offset) for offset in offsets)  # Sequential mode
+        for page in pages:
+            items.extend(page['items'])
+        return items
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(offsets))) as pool:
+        # map() yields results in submission order, which keeps the tracks in playlist order
+        for page in pool.map(propagate(fetch_page), offsets):
+            items.extend(page['items'])
+    return items
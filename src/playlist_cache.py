@@ -0,0 +1,117 @@
+# Shared playlist fetch layer that caches each playlist's tracks by its snapshot_id
+
+import json
+import os
+import time
+from collections import OrderedDict
+
+from pagination import MAX_CONCURRENCY, fetch_all_pages
+from tracing import stage
+from track_record import TRACK_FIELDS, Track, compact_page
+
+try:
+    import redis
+except ImportError:  # Redis is optional, the in-process cache is used without it
+    redis = None
+
+CACHE_TTL = int(os.getenv('ORPHEUS_CACHE_TTL', 7 * 24 * 60 * 60))  # Seconds a cached playlist is kept (default: one week)
+LOCAL_CACHE_SIZE = int(os.getenv('ORPHEUS_LOCAL_CACHE_SIZE', 64))  # Playlists kept by the in-process fallback cache
+REDIS_URL = os.getenv('ORPHEUS_REDIS_URL', 'redis://localhost:6379/0')  # Where to find the Redis server
+KEY_PREFIX = 'orpheus:playlist:v2:'  # Namespace for playlist entries in Redis (v2: tracks stored as Track rows)
+CACHE_DIR = os.getenv('ORPHEUS_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'orpheus'))  # Local state files live here
+
+# In-process LRU cache with per-entry expiry, used when Redis is not running
+class LocalCache:
+    def __init__(self, max_entries=LOCAL_CACHE_SIZE, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # playlist_id -> (expires_at, snapshot_id, tracks), oldest first
+
+    def get(self, playlist_id, snapshot_id):
+        entry = self.entries.get(playlist_id)
+        if entry is None:
+            return None
+        expires_at, cached_snapshot_id, tracks = entry
+        if expires_at < time.monotonic() or cached_snapshot_id != snapshot_id:
+            del self.entries[playlist_id]  # Drops expired or outdated snapshots
+            return None
+        self.entries.move_to_end(playlist_id)  # Marks the entry as recently used
+        return tracks
+
+    def set(self, playlist_id, snapshot_id, tracks):
+        self.entries[playlist_id] = (time.monotonic() + self.ttl, snapshot_id, tracks)
+        self.entries.move_to_end(playlist_id)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)  # Evicts the least recently used playlist
+
+# Redis-backed cache shared between runs and scripts
+# Entries expire after the TTL; configure the server with maxmemory-policy allkeys-lru for LRU eviction
+class RedisCache:
+    def __init__(self, client, ttl=CACHE_TTL):
+        self.client = client
+        self.ttl = ttl
+
+    def get(self, playlist_id, snapshot_id):
+        try:
+            payload = self.client.get(KEY_PREFIX + playlist_id)
+        except redis.RedisError:
+            return None  # Treats an unreachable server as a cache miss
+        if payload is None:
+            return None
+        entry = json.loads(payload)
+        if entry['snapshot_id'] != snapshot_id:
+            return None  # The playlist changed since it was cached
+        return [Track.from_row(row) for row in entry['tracks']]
+
+    def set(self, playlist_id, snapshot_id, tracks):
+        payload = json.dumps({'snapshot_id': snapshot_id, 'tracks': [track.to_row() for track in tracks]})
+        try:
+            # One key per playlist, so a new snapshot replaces the old one instead of piling up
+            self.client.set(KEY_PREFIX + playlist_id, payload, ex=self.ttl)
+        except redis.RedisError:
+            pass  # Caching is best effort
+
+_cache = None  # Cache instance shared by every fetch in this process
+
+# Returns the shared cache, connecting to Redis on first use and falling back to the in-process cache
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = LocalCache()
+        if redis is not None:
+            try:
+                client = redis.Redis.from_url(REDIS_URL, socket_connect_timeout=1)
+                client.ping()  # Fails fast when no server is running
+                _cache = RedisCache(client)
+            except redis.RedisError:
+                pass
+    return _cache
+
+# Fetches the current snapshot_id of a playlist with a single lightweight metadata call
+def get_playlist_snapshot(sp, playlist_id):
+    return sp.playlist(playlist_id, fields='snapshot_id')['snapshot_id']
+
+# Function to retrieve all tracks from a specified playlist, handling Spotify's pagination
+# Pass the snapshot_id when it is already known (e.g. from a playlist listing) to skip the metadata call;
+# pages after the first are fetched concurrently, at most max_workers at a time.
+# Returns one Track per playlist position; each page is compacted as soon as it arrives, so the raw
+# API items never pile up
+def get_playlist_tracks(sp, playlist_id, snapshot_id=None, max_workers=MAX_CONCURRENCY):
+    cache = get_cache()
+    if snapshot_id is None:
+        snapshot_id = get_playlist_snapshot(sp, playlist_id)
+    tracks = cache.get(playlist_id, snapshot_id)
+    if tracks is not None:
+        return tracks  # The playlist is unchanged, no paging needed
+
+    with stage('fetch tracks'):
+        tracks = fetch_all_pages(lambda offset: compact_page(sp.playlist_tracks(playlist_id, fields=TRACK_FIELDS, offset=offset)),
+                                 max_workers)
+    cache.set(playlist_id, snapshot_id, tracks)
+    return tracks  # Returns the complete list of tracks from the playlist
+
+# Lists every playlist of the current user, fetching the pages after the first 50 concurrently
+# Each listed playlist carries its snapshot_id, so tracks can be fetched without another metadata call
+def get_user_playlists(sp, max_workers=MAX_CONCURRENCY):
+    with stage('list playlists'):
+        return fetch_all_pages(lambda offset: sp.current_user_playlists(limit=50, offset=offset), max_workers)
@@ -0,0 +1,107 @@
+# Batched write operations on playlists that keep the local track list in sync
+
+from playlist_cache import get_cache
+from tracing import stage
+
+MAX_ITEMS_PER_REQUEST = 100  # Spotify's limit for the number of tracks changed in a single request
+
+# Removes the tracks at the given positions in a single pass, 100 positions per request
+# Positions refer to the playlist as of snapshot_id; they are removed from the highest down, so one batch
+# never shifts the positions of the next. Returns the remaining tracks and the playlist's new snapshot_id,
+# which are also stored in the playlist cache so the playlist does not have to be downloaded again.
+def remove_tracks_at_positions(sp, playlist_id, tracks, positions, snapshot_id):
+    removed = set(positions)
+    snapshot_id = remove_tracks(sp, playlist_id, [(position, tracks[position]) for position in removed], snapshot_id)
+    remaining_tracks = [track for position, track in enumerate(tracks) if position not in removed]
+    if removed:
+        get_cache().set(playlist_id, snapshot_id, remaining_tracks)
+    return remaining_tracks, snapshot_id
+
+# Removes (position, track) pairs from the highest position down, 100 per request, and returns the new snapshot_id
+# Positions refer to the playlist as of snapshot_id, for callers that don't hold the whole track list
+def remove_tracks(sp, playlist_id, pairs, snapshot_id):
+    pairs = sorted(pairs, key=lambda pair: pair[0], reverse=True)
+    with stage('remove tracks'):
+        for i in range(0, len(pairs), MAX_ITEMS_PER_REQUEST):
+            # Each request builds on the previous snapshot
+            snapshot_id = remove_batch(sp, playlist_id, pairs[i:i + MAX_ITEMS_PER_REQUEST], snapshot_id)
+    return snapshot_id
+
+# Removes up to 100 (position, track) pairs in one request and returns the playlist's new snapshot_id
+def remove_batch(sp, playlist_id, batch, snapshot_id):
+    items_by_uri = {}  # Groups the positions of each URI, as the API expects one entry per URI
+    for position, track in batch:
+        items_by_uri.setdefault(track.uri, []).append(position)
+    items = [{'uri': uri, 'positions': item_positions} for uri, item_positions in items_by_uri.items()]
+    return sp.playlist_remove_specific_occurrences_of_items(playlist_id, items, snapshot_id)['snapshot_id']
+
+# Returns the set of values in the longest increasing subsequence of seq (patience sorting, O(n log n))
+def longest_increasing_subsequence(seq):
+    tails = []  # tails[k] is the index in seq of the smallest tail of an increasing run of length k + 1
+    previous = [-1] * len(seq)  # Back-pointers used to rebuild the subsequence
+    for i, value in enumerate(seq):
+        low, high = 0, len(tails)
+        while low < high:  # Binary search for the first tail that is not smaller than value
+            mid = (low + high) // 2
+            if seq[tails[mid]] < value:
+                low = mid + 1
+            else:
+                high = mid
+        if low > 0:
+            previous[i] = tails[low - 1]
+        if low == len(tails):
+            tails.append(i)
+        else:
+            tails[low] = i
+
+    kept = set()
+    i = tails[-1] if tails else -1
+    while i != -1:
+        kept.add(seq[i])
+        i = previous[i]
+    return kept
+
+# Plans the playlist_reorder_items range moves that turn current_tracks into target_tracks
+# target_tracks must hold the same track objects in a new order. Tracks on the longest increasing
+# subsequence stay put; every other run of consecutive tracks is moved in one request to just after its
+# predecessor in the target order. Returns a list of (range_start, insert_before, range_length) moves,
+# or None as soon as more than max_moves would be needed.
+def plan_reorder_moves(current_tracks, target_tracks, max_moves=None):
+    target_rank = {id(track): rank for rank, track in enumerate(target_tracks)}
+    order = [target_rank[id(track)] for track in current_tracks]  # Target rank of each track, in current order
+    kept = longest_increasing_subsequence(order)
+
+    moves = []
+    rank = 0
+    while rank < len(order):
+        if rank in kept:
+            rank += 1
+            continue
+        range_start = order.index(rank)
+        insert_before = order.index(rank - 1) + 1 if rank > 0 else 0  # Right after its predecessor
+        range_length = 1
+        while (rank + range_length not in kept and range_start + range_length < len(order)
+               and order[range_start + range_length] == rank + range_length):
+            range_length += 1  # Moves runs that are already in order together
+        if range_start != insert_before:
+            if max_moves is not None and len(moves) >= max_moves:
+                return None
+            moves.append((range_start, insert_before, range_length))
+            block = order[range_start:range_start + range_length]
+            del order[range_start:range_start + range_length]
+            new_start = insert_before if insert_before < range_start else insert_before - range_length
+            order[new_start:new_start] = block
+        rank += range_length
+    return moves
+
+# Applies planned range moves to a playlist, chaining the snapshot_id of each request into the next
+# Returns the playlist's new snapshot_id and stores target_tracks in the playlist cache under it
+def reorder_playlist_tracks(sp, playlist_id, moves, target_tracks, snapshot_id):
+    with stage('reorder tracks'):
+        for range_start, insert_before, range_length in moves:
+            result = sp.playlist_reorder_items(playlist_id, range_start, insert_before, range_length=range_length,
+                                               snapshot_id=snapshot_id)
+            snapshot_id = result['snapshot_id']
+    if moves:
+        get_cache().set(playlist_id, snapshot_id, target_tracks)
+    return snapshot_id
@@ -1,98 +1,229 @@
 # Sort playlists by: Danceability, Energy, Valence, Tempo, Loudness, Acousticnes or Popularity
+# Custom sorts combine several weighted keys and can filter tracks by feature ranges
 
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
-import os
+import contextlib
+import operator
+import re
 
-# Authenticate with Spotify using OAuth
-def authenticate_spotify():
-    # Initializes the Spotipy client with user credentials
-    sp = spotipy.Spotify(auth_manager=SpotifyOAuth(
-        client_id=os.getenv('SPOTIFY_CLIENT_ID'),  # Your Spotify app's client ID - from Environment Variable
-        client_secret=os.getenv('SPOTIFY_CLIENT_SECRET'),  # Your Spotify app's client secret - from Environment Variable
-        redirect_uri='http://127.0.0.1:5000',  # Redirect URI set in your Spotify app
-        scope="playlist-modify-private,playlist-read-private,playlist-modify-public"))  # Scopes define permissions
-    return sp
+import numpy as np
+
+from feature_store import FeatureStore
+from playlist_cache import get_playlist_snapshot, get_playlist_tracks, get_user_playlists
+from playlist_edits import plan_reorder_moves, reorder_playlist_tracks
+from spotify_client import authenticate_spotify
+from tracing import stage
+
+AUDIO_FEATURES = ['danceability', 'energy', 'valence', 'tempo', 'loudness', 'acousticness']  # Features from sp.audio_features
+SORT_FEATURES = AUDIO_FEATURES + ['popularity']  # Columns of the feature matrix, in order
+FILTER_OPERATORS = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le, '=': operator.eq}
 
 # Find a playlist by name and return its Spotify ID
-def find_playlist_by_name(sp, user_id, playlist_name):
-    playlists = sp.user_playlists(user_id)  # Fetches playlists for the current user
-    for playlist in playlists['items']:  # Iterates through the playlists
+def find_playlist_by_name(sp, playlist_name):
+    playlists = get_user_playlists(sp)  # Fetches every playlist of the current user, not only the first 50
+    for playlist in playlists:  # Iterates through the playlists
         if playlist['name'].lower() == playlist_name.lower():  # Case-insensitive comparison
             return playlist['id']  # Returns the ID of the matching playlist
     return None  # Returns None if no matching playlist is found
 
-# Fetch all tracks from a specified playlist
-def get_playlist_tracks(sp, playlist_id):
-    tracks = []
-    results = sp.playlist_tracks(playlist_id)  # Initial fetch of playlist tracks
-    tracks.extend(results['items'])  # Adds the first batch of tracks to the list
-    while results['next']:  # Checks if there are more tracks to fetch
-        results = sp.next(results)  # Fetches the next batch of tracks
-        tracks.extend(results['items'])  # Adds subsequent batches of tracks to the list
-    return tracks
-
 # Fetch audio features for a list of tracks
-def get_audio_features(sp, tracks, sort_feature):
-    if sort_feature in ['danceability', 'energy', 'valence', 'tempo', 'loudness', 'acousticness']:
-        track_ids = [track['track']['id'] for track in tracks if track['track']['id'] is not None]  # Extract track IDs
-        features_list = []
-        for i in range(0, len(track_ids), 100):  # Spotify limits batch size to 100
-            batch_ids = track_ids[i:i+100]  # Creates batches of up to 100 track IDs
-            features_list.extend(sp.audio_features(batch_ids))  # Fetches audio features for each batch
-        return features_list
-    return None  # Returns None if sorting by popularity (no need to fetch audio features)
-
-# Sort tracks by the specified audio feature or popularity
-def sort_tracks(tracks, features, sort_feature, sort_order):
-    reverse_order = True if sort_order == '2' else False  # Determines sort order (ascending or descending)
-    if features:  # Sorting based on audio features
-        track_features = {feature['id']: feature for feature in features}  # Maps track IDs to their audio features
-        sorted_tracks = sorted(tracks, key=lambda x: track_features[x['track']['id']][sort_feature], reverse=reverse_order)
-    else:  # Sorting based on popularity
-        sorted_tracks = sorted(tracks, key=lambda x: x['track']['popularity'], reverse=reverse_order)
-    return sorted_tracks
+# Features are read from the local feature store; only tracks not stored yet are requested from Spotify
+# A store opened here is closed again before returning, so long-running callers don't leak connections
+def get_audio_features(sp, tracks, store=None):
+    if store is None:
+        with contextlib.closing(FeatureStore()) as store:
+            return get_audio_features(sp, tracks, store)
+    track_ids = list(dict.fromkeys(track.id for track in tracks if track.id is not None))  # Extract unique track IDs
+    known_features = store.get_many(track_ids)
+    missing_ids = [track_id for track_id in track_ids if track_id not in known_features]
+    with stage('audio features'):
+        for i in range(0, len(missing_ids), 100):  # Spotify limits batch size to 100
+            batch_ids = missing_ids[i:i+100]  # Creates batches of up to 100 track IDs
+            batch_features = sp.audio_features(batch_ids)  # Fetches audio features for each batch
+            store.put_many(batch_ids, batch_features)  # Saves them so the next sort needs no request
+            known_features.update(zip(batch_ids, batch_features))
+    return [known_features[track_id] for track_id in track_ids if known_features[track_id]]
+
+# Build a (tracks x SORT_FEATURES) array aligned with the track list; missing values are NaN
+def build_feature_matrix(tracks, features):
+    features_by_id = {feature['id']: feature for feature in features or [] if feature}
+    matrix = np.full((len(tracks), len(SORT_FEATURES)), np.nan)
+    popularity_column = SORT_FEATURES.index('popularity')
+    for row, track in enumerate(tracks):
+        if track.popularity is not None:  # Local files and unavailable tracks keep NaN everywhere
+            matrix[row, popularity_column] = track.popularity
+        track_features = features_by_id.get(track.id)
+        if track_features:
+            matrix[row, :len(AUDIO_FEATURES)] = [track_features[feature] for feature in AUDIO_FEATURES]
+    return matrix
+
+# Parse a sort spec such as "energy desc, tempo" or "0.7 energy + 0.3 valence desc" into sort keys
+# Each comma-separated key is a weighted sum of features followed by an optional asc/desc
+def parse_sort_keys(spec):
+    sort_keys = []
+    for key in spec.split(','):
+        words = key.split()
+        if not words:
+            continue
+        descending = words[-1].lower() == 'desc'
+        if words[-1].lower() in ('asc', 'desc'):
+            words = words[:-1]
+        weights = {}
+        for term in ' '.join(words).split('+'):
+            match = re.fullmatch(r'\s*(?:([\d.]+)\s*\*?\s*)?([a-z]+)\s*', term.lower())
+            if not match or match.group(2) not in SORT_FEATURES:
+                raise ValueError(f"Unknown sort key: {term.strip()!r}")
+            weights[match.group(2)] = float(match.group(1) or 1)
+        sort_keys.append((weights, descending))
+    return sort_keys
+
+# Parse a filter spec such as "tempo 120-130, valence > 0.6" into (feature, comparison, value) filters
+def parse_filters(spec):
+    filters = []
+    for condition in spec.split(','):
+        condition = condition.strip().lower()
+        if not condition:
+            continue
+        range_match = re.fullmatch(r'([a-z]+)\s+(-?[\d.]+)\s*-\s*(-?[\d.]+)', condition)
+        compare_match = re.fullmatch(r'([a-z]+)\s*(>=|<=|>|<|=)\s*(-?[\d.]+)', condition)
+        if range_match and range_match.group(1) in SORT_FEATURES:
+            feature, low, high = range_match.groups()
+            filters.append((feature, 'between', (float(low), float(high))))
+        elif compare_match and compare_match.group(1) in SORT_FEATURES:
+            feature, comparison, value = compare_match.groups()
+            filters.append((feature, comparison, float(value)))
+        else:
+            raise ValueError(f"Invalid filter: {condition!r}")
+    return filters
+
+# Compute one sort key column; keys combining several features use min-max scaled values so weights compare
+def sort_key_values(matrix, weights):
+    if len(weights) == 1:
+        feature, weight = next(iter(weights.items()))
+        return matrix[:, SORT_FEATURES.index(feature)] * weight
+    values = np.zeros(len(matrix))
+    for feature, weight in weights.items():
+        column = matrix[:, SORT_FEATURES.index(feature)]
+        low, high = np.nanmin(column, initial=np.inf), np.nanmax(column, initial=-np.inf)
+        scale = high - low if high > low else 1.0
+        values += weight * (column - low) / scale  # NaN propagates, marking the track as missing
+    return values
+
+# Sort tracks by one or more weighted keys, keeping only the tracks that pass every filter
+# Tracks missing a sort feature (local files, unavailable tracks) go to the end in playlist order
+def sort_tracks(tracks, features, sort_keys, filters=()):
+    matrix = build_feature_matrix(tracks, features)
+    selected = np.ones(len(tracks), dtype=bool)
+    for feature, comparison, value in filters:
+        column = matrix[:, SORT_FEATURES.index(feature)]
+        if comparison == 'between':
+            selected &= (column >= value[0]) & (column <= value[1])
+        else:
+            selected &= FILTER_OPERATORS[comparison](column, value)  # NaN never passes a filter
+    rows = np.flatnonzero(selected)
+
+    key_columns = []
+    missing = np.zeros(len(rows), dtype=bool)
+    for weights, descending in sort_keys:
+        values = sort_key_values(matrix[rows], weights)
+        missing |= np.isnan(values)
+        key_columns.append(-values if descending else values)
+    # np.lexsort is stable and treats its last key as the primary one
+    order = np.lexsort(key_columns[::-1] + [missing]) if key_columns else np.arange(len(rows))
+    return [tracks[row] for row in rows[order]]
 
 # Replace the tracks in the specified playlist with the sorted list of tracks
 def replace_playlist_tracks(sp, playlist_id, sorted_tracks):
-    track_uris = [track['track']['uri'] for track in sorted_tracks]  # Extracts URIs of sorted tracks
+    track_uris = [track.uri for track in sorted_tracks if track.uri]  # Extracts URIs of sorted tracks
     max_tracks_per_request = 100  # Spotify's limit for adding/replacing tracks per request
-    sp.playlist_replace_items(playlist_id, track_uris[:max_tracks_per_request])  # Replaces the first batch of tracks
-    if len(track_uris) > max_tracks_per_request:
-        for start_index in range(max_tracks_per_request, len(track_uris), max_tracks_per_request):
-            batch = track_uris[start_index:start_index + max_tracks_per_request]  # Creates batches of track URIs
-            sp.playlist_add_items(playlist_id, batch)  # Adds remaining batches of tracks to the playlist
-    print(f"Playlist {playlist_name} has been updated with tracks sorted by {sort_feature}.")
+    with stage('replace tracks'):
+        sp.playlist_replace_items(playlist_id, track_uris[:max_tracks_per_request])  # Replaces the first batch of tracks
+        if len(track_uris) > max_tracks_per_request:
+            for start_index in range(max_tracks_per_request, len(track_uris), max_tracks_per_request):
+                batch = track_uris[start_index:start_index + max_tracks_per_request]  # Creates batches of track URIs
+                sp.playlist_add_items(playlist_id, batch)  # Adds remaining batches of tracks to the playlist
+
+# Create a new private playlist holding the given tracks, 100 tracks per request
+def create_playlist_from_tracks(sp, user_id, playlist_name, tracks):
+    track_uris = [track.uri for track in tracks if track.id]  # Local files cannot be added
+    with stage('create playlist'):
+        playlist_id = sp.user_playlist_create(user_id, playlist_name, public=False)['id']
+        for start_index in range(0, len(track_uris), 100):
+            sp.playlist_add_items(playlist_id, track_uris[start_index:start_index + 100])
+    return playlist_id
+
+# Update the playlist to the sorted order with as few write calls as possible
+# Moves only the tracks outside the longest already-sorted run with playlist_reorder_items, which also keeps
+# their 'added_at' dates, and falls back to a full replace when that would take fewer calls
+# Local files and unavailable tracks cannot be written back by a replace, so playlists holding any are
+# always reordered, however many moves that takes
+def update_playlist_order(sp, playlist_id, tracks, sorted_tracks, snapshot_id):
+    replace_calls = max(1, -(-len(sorted_tracks) // 100))  # Calls a full replace needs (one per 100 tracks)
+    can_replace = all(track.id for track in sorted_tracks)
+    moves = plan_reorder_moves(tracks, sorted_tracks, max_moves=replace_calls if can_replace else None)
+    if moves is None:
+        replace_playlist_tracks(sp, playlist_id, sorted_tracks)
+        return replace_calls
+    reorder_playlist_tracks(sp, playlist_id, moves, sorted_tracks, snapshot_id)
+    return len(moves)
+
+# Fetch audio features only when a sort key or filter needs them (popularity comes with the tracks)
+def get_needed_audio_features(sp, tracks, sort_keys, filters=()):
+    used_features = {feature for weights, _ in sort_keys for feature in weights} | {feature for feature, _, _ in filters}
+    if used_features & set(AUDIO_FEATURES):
+        return get_audio_features(sp, tracks)
+    return None
+
+# Sort a playlist in place by the given sort keys and return the number of write calls made
+def sort_playlist(sp, playlist_id, snapshot_id, sort_keys):
+    tracks = get_playlist_tracks(sp, playlist_id, snapshot_id)  # Fetches tracks from the specified playlist
+    features = get_needed_audio_features(sp, tracks, sort_keys)  # Fetches audio features if needed
+    sorted_tracks = sort_tracks(tracks, features, sort_keys)  # Sorts the tracks
+    return update_playlist_order(sp, playlist_id, tracks, sorted_tracks, snapshot_id)  # Updates the playlist with sorted tracks
 
 # Main execution block
 if __name__ == "__main__":
     sp = authenticate_spotify()  # Authenticates and creates a Spotipy client
     user_id = sp.current_user()['id']  # Fetches the current user's Spotify ID
     playlist_name = input("Enter the playlist name: ")  # Prompts the user for a playlist name
-    playlist_id = find_playlist_by_name(sp, user_id, playlist_name)  # Retrieves the playlist ID by name
+    playlist_id = find_playlist_by_name(sp, playlist_name)  # Retrieves the playlist ID by name
 
     if playlist_id:
         # Prompts the user to choose an audio feature for sorting
         print("Choose a feature to sort by:")
-        print("1: Danceability\n2: Energy\n3: Valence\n4: Tempo\n5: Loudness\n6: Acousticness\n7: Popularity")
+        print("1: Danceability\n2: Energy\n3: Valence\n4: Tempo\n5: Loudness\n6: Acousticness\n7: Popularity\n8: Custom (several keys, weights and filters)")
         feature_option = input("Enter the number of your chosen feature: ")
-        # Maps user input to corresponding audio feature
-        feature_map = {
-            '1': 'danceability', '2': 'energy', '3': 'valence', 
-            '4': 'tempo', '5': 'loudness', '6': 'acousticness', '7': 'popularity'
-        }
-        sort_feature = feature_map.get(feature_option, 'popularity')  # Default to 'popularity' if input is invalid
-
-        # Prompts the user to choose the sorting order
-        print("Choose sorting order:")
-        print("1: Ascending\n2: Descending")
-        sort_order = input("Enter the number of your chosen sorting order: ")
-
-        tracks = get_playlist_tracks(sp, playlist_id)  # Fetches tracks from the specified playlist
-        features = None
-        if sort_feature != 'popularity':  # Fetches audio features if needed
-            features = get_audio_features(sp, tracks, sort_feature)
-        sorted_tracks = sort_tracks(tracks, features, sort_feature, sort_order)  # Sorts the tracks
-        replace_playlist_tracks(sp, playlist_id, sorted_tracks)  # Updates the playlist with sorted tracks
+        filters = []
+        if feature_option == '8':
+            # Custom sorts take several weighted keys and optional range filters, e.g. "energy desc, tempo"
+            sort_description = input("Enter sort keys (e.g. 'energy desc, tempo' or '0.7 energy + 0.3 valence desc'): ")
+            sort_keys = parse_sort_keys(sort_description)
+            filters = parse_filters(input("Enter filters, or leave empty (e.g. 'tempo 120-130, valence > 0.6'): "))
+        else:
+            # Maps user input to corresponding audio feature
+            feature_map = {
+                '1': 'danceability', '2': 'energy', '3': 'valence',
+                '4': 'tempo', '5': 'loudness', '6': 'acousticness', '7': 'popularity'
+            }
+            sort_description = feature_map.get(feature_option, 'popularity')  # Default to 'popularity' if input is invalid
+
+            # Prompts the user to choose the sorting order
+            print("Choose sorting order:")
+            print("1: Ascending\n2: Descending")
+            sort_order = input("Enter the number of your chosen sorting order: ")
+            sort_keys = [({sort_description: 1.0}, sort_order == '2')]
+
+        snapshot_id = get_playlist_snapshot(sp, playlist_id)  # Reorders are applied against this snapshot
+        if filters:
+            tracks = get_playlist_tracks(sp, playlist_id, snapshot_id)  # Fetches tracks from the specified playlist
+            features = get_needed_audio_features(sp, tracks, sort_keys, filters)  # Fetches audio features if needed
+            sorted_tracks = sort_tracks(tracks, features, sort_keys, filters)  # Sorts and filters the tracks
+
+            # Filtering drops tracks, so the result goes to a new playlist instead of replacing the original
+            new_playlist_name = f"{playlist_name} ({sort_description})"
+            create_playlist_from_tracks(sp, user_id, new_playlist_name, sorted_tracks)
+            print(f"Created {new_playlist_name} with {len(sorted_tracks)} of {len(tracks)} tracks.")
+        else:
+            write_calls = sort_playlist(sp, playlist_id, snapshot_id, sort_keys)
+            print(f"Playlist {playlist_name} has been updated with tracks sorted by {sort_description} ({write_calls} write calls).")
     else:
         print("Playlist not found. Please check the name and try again.")
@@ -0,0 +1,140 @@
+# Shared Spotify client used by every script
+# One pooled HTTP session, a token cache that survives between runs, and a token-bucket rate limiter
+# shared by all threads that slows down when Spotify answers 429 and speeds back up once requests succeed
+
+import os
+import threading
+import time
+
+import requests
+import spotipy
+from spotipy.cache_handler import CacheFileHandler
+from spotipy.oauth2 import SpotifyOAuth
+from urllib3.util.retry import Retry
+
+import tracing
+from pagination import MAX_CONCURRENCY
+from playlist_cache import CACHE_DIR
+
+# Every scope any script needs, so one cached token serves them all
+SCOPE = 'playlist-modify-private,playlist-read-private,playlist-modify-public'
+TOKEN_PATH = os.getenv('ORPHEUS_TOKEN_CACHE', os.path.join(CACHE_DIR, 'token.json'))  # Refreshed tokens are saved here
+RATE_LIMIT = float(os.getenv('ORPHEUS_RATE_LIMIT', 20))  # Requests per second the limiter allows at most
+RATE_BURST = int(os.getenv('ORPHEUS_RATE_BURST', MAX_CONCURRENCY))  # Requests that may start at once after a quiet spell
+MIN_RATE = 1.0  # Slowest the limiter goes, however often Spotify throttles
+RATE_INCREASE = 0.1  # Requests per second won back by every successful request
+MAX_RETRIES = 5  # Times a throttled (429) request is retried before giving up
+MAX_BACKOFF = 30  # Longest wait in seconds when Spotify sends no Retry-After header
+
+# Works out how long to wait after a 429, preferring Spotify's Retry-After header over exponential backoff
+def get_retry_delay(error, attempt):
+    retry_after = (error.headers or {}).get('Retry-After')
+    try:
+        return max(float(retry_after), 0)
+    except (TypeError, ValueError):
+        return min(2 ** attempt, MAX_BACKOFF)
+
+# Token bucket shared by every thread of the process
+# A 429 pauses all requests until Retry-After has passed and halves the rate; each success raises it a little,
+# so the rate settles just under whatever Spotify currently tolerates
+class RateLimiter:
+    def __init__(self, rate=RATE_LIMIT, burst=RATE_BURST):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # No request starts before this time, set from Retry-After
+        self.lock = threading.Lock()
+
+    # Blocks until a request may be sent
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                else:
+                    self.tokens = min(self.burst, self.tokens + max(0.0, now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self, retry_after):
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            self.rate = max(MIN_RATE, self.rate / 2)
+            self.tokens = 0.0  # No burst right after the pause
+            self.updated = self.blocked_until
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + RATE_INCREASE)
+
+    # Runs func once a request may be sent, retrying it after every 429 until MAX_RETRIES is reached
+    # The only place 429s are retried, so a throttled request is never retried twice over
+    def call(self, func, *args, **kwargs):
+        for attempt in range(MAX_RETRIES + 1):
+            self.acquire()
+            try:
+                result = func(*args, **kwargs)
+            except spotipy.SpotifyException as error:
+                if error.http_status != 429 or attempt == MAX_RETRIES:
+                    raise
+                self.throttled(get_retry_delay(error, attempt))
+                tracing.note_retry()
+                continue
+            self.succeeded()
+            return result
+
+_limiter = RateLimiter()  # Shared by every client in this process
+
+# spotipy.Spotify whose requests all go through the shared rate limiter, and are traced when tracing is on
+# 429s are handled here rather than by the session, so the limiter learns from every Retry-After
+class OrpheusSpotify(spotipy.Spotify):
+    def __init__(self, *args, limiter=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.limiter = limiter or _limiter
+
+    def _internal_call(self, method, url, payload, params):
+        if tracing.is_enabled():
+            return tracing.trace_call(self._limited_call, method, url, payload, params)
+        return self._limited_call(method, url, payload, params)
+
+    def _limited_call(self, method, url, payload, params):
+        return self.limiter.call(super()._internal_call, method, url, payload, params)
+
+# Builds a requests session whose connection pool fits the concurrent page fetches
+# Connection errors and 5xx responses are retried by urllib3; 429s are left to OrpheusSpotify
+def build_session():
+    session = requests.Session()
+    # urllib3 would otherwise retry any 429 carrying Retry-After itself, hiding it from the limiter
+    retry = Retry(total=3, connect=None, read=False, allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+                  status=3, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504), respect_retry_after_header=False)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max(MAX_CONCURRENCY, 10), max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if tracing.is_enabled():
+        session.hooks['response'].append(tracing.count_response_bytes)
+    return session
+
+_session = None  # Session shared by the client and its token refreshes
+
+# Authenticates with Spotify and returns the shared client
+# The token is cached in TOKEN_PATH and refreshed from there, so only the very first run opens the browser
+def authenticate_spotify():
+    global _session
+    if _session is None:
+        _session = build_session()
+    os.makedirs(os.path.dirname(os.path.abspath(TOKEN_PATH)), exist_ok=True)
+    auth_manager = SpotifyOAuth(
+        client_id=os.getenv('SPOTIFY_CLIENT_ID'),
+        client_secret=os.getenv('SPOTIFY_CLIENT_SECRET'),
+        redirect_uri=os.getenv('SPOTIFY_REDIRECT_URI', 'http://127.0.0.1:5000'),  # Must match the app settings on the Spotify Developer Dashboard
+        scope=SCOPE,
+        cache_handler=CacheFileHandler(cache_path=TOKEN_PATH),
+        requests_session=_session)
+    return OrpheusSpotify(auth_manager=auth_manager, requests_session=_session)
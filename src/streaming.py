@@ -0,0 +1,107 @@
+# Streaming pipeline for the clean and dedupe scripts: fetch pages -> tracks -> matches -> removal batches
+# Every stage is a generator consuming the one before it, so only a few pages are held at a time, and
+# removals go out on a writer thread while the next pages are still downloading.
+
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from matching import find_saved_copy
+from pagination import MAX_CONCURRENCY
+from playlist_edits import MAX_ITEMS_PER_REQUEST, remove_batch
+from tracing import propagate, stage
+from track_record import TRACK_FIELDS, compact_page
+
+PAGE_SIZE = 100  # Largest page playlist_tracks returns
+WRITE_QUEUE_SIZE = 2  # Removal batches waiting for the writer; a slow writer holds the readers back
+
+# Returns a playlist's current snapshot_id and length with one metadata call
+def get_playlist_info(sp, playlist_id):
+    playlist = sp.playlist(playlist_id, fields='snapshot_id,tracks(total)')
+    return playlist['snapshot_id'], playlist['tracks']['total']
+
+# Yields (offset, tracks) for every page of a playlist, in playlist order or last page first when reverse is set
+# Pages are downloaded ahead of the consumer, but never more than max_workers at once
+def stream_pages(sp, playlist_id, total, reverse=False, max_workers=MAX_CONCURRENCY):
+    def fetch(offset):
+        with stage('fetch tracks'):
+            page = sp.playlist_tracks(playlist_id, fields=TRACK_FIELDS, limit=PAGE_SIZE, offset=offset)
+            return compact_page(page)['items']
+
+    offsets = range(0, total, PAGE_SIZE)
+    fetch = propagate(fetch)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        pending = deque()  # (offset, future) in the order the pages are yielded
+        for offset in reversed(offsets) if reverse else offsets:
+            pending.append((offset, pool.submit(fetch, offset)))
+            if len(pending) >= max_workers:
+                offset, future = pending.popleft()
+                yield offset, future.result()
+        while pending:
+            offset, future = pending.popleft()
+            yield offset, future.result()
+
+# Yields (position, track) for every track of the streamed pages, in the same direction as the pages
+def stream_tracks(pages, reverse=False):
+    for offset, tracks in pages:
+        for index in reversed(range(len(tracks))) if reverse else range(len(tracks)):
+            yield offset + index, tracks[index]
+
+# Yields the (position, track) pairs that are the same recording as a track of the given playlists in the
+# library index: same ISRC, or same normalized title and artist with a close length
+# Local files and unavailable tracks are skipped, as they cannot be removed by URI
+def match_saved(tracks, index, playlist_ids, min_confidence=0.0):
+    for position, track in tracks:
+        if not track.id:
+            continue
+        match = find_saved_copy(track, index.saved_copies(track, playlist_ids))
+        if match and match[0] >= min_confidence:
+            yield position, track
+
+# Groups a stream into lists of up to size items, yielding each list as soon as it is full
+def batched(items, size=MAX_ITEMS_PER_REQUEST):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# Removes batches of (position, track) pairs as they are produced, on a writer thread, and returns
+# (tracks removed, new snapshot_id). Positions must descend across batches and only refer to tracks that
+# were already read, so a removal never shifts a page that is still to be fetched.
+def remove_batches(sp, playlist_id, batches, snapshot_id):
+    writes = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+    state = {'snapshot_id': snapshot_id, 'removed': 0, 'error': None}
+
+    def write():
+        with stage('remove tracks'):
+            while True:
+                batch = writes.get()
+                if batch is None:
+                    return
+                if state['error']:
+                    continue  # Drains the queue after a failure so the producer never blocks
+                try:
+                    # Each request builds on the snapshot the previous one produced
+                    state['snapshot_id'] = remove_batch(sp, playlist_id, batch, state['snapshot_id'])
+                    state['removed'] += len(batch)
+                except Exception as error:
+                    state['error'] = error
+
+    writer = threading.Thread(target=propagate(write), daemon=True)
+    writer.start()
+    try:
+        for batch in batches:
+            if state['error']:
+                break  # Stops reading once a write failed
+            writes.put(batch)
+    finally:
+        writes.put(None)
+        writer.join()
+    if state['error']:
+        raise state['error']
+    return state['removed'], state['snapshot_id']
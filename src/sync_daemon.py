@@ -0,0 +1,170 @@
+# Long-running sync service that keeps the library maintained without re-running the scripts by hand
+# Polls playlist snapshot_ids and runs only the pipelines whose input playlists changed
+
+# Usage: python sync_daemon.py [config.json]
+# The config is a JSON object like DEFAULT_CONFIG below. Pipeline actions:
+#   cratedigger        - adds Discover Weekly to CRATEDIGGER (input: Discover Weekly)
+#   clean_cratedigger  - removes tracks saved in "against" from CRATEDIGGER
+#   clean              - removes tracks saved in "against" from "playlist"
+#   dedupe             - removes exact and true duplicates from "playlist"
+#   sort               - sorts "playlist" in place by "sort", e.g. "energy desc, tempo"
+
+import json
+import os
+import sys
+import time
+
+import clean_cratedigger
+import clean_playlist
+import cratedigger
+import sort
+import tracing
+import true_duplicates
+from library_index import LibraryIndex
+from playlist_cache import CACHE_DIR, get_user_playlists
+from spotify_client import authenticate_spotify
+
+STATE_PATH = os.getenv('ORPHEUS_SYNC_STATE', os.path.join(CACHE_DIR, 'sync_state.json'))
+
+DEFAULT_CONFIG = {
+    'poll_interval': 300,  # Seconds between snapshot polls
+    'settle_time': 120,  # Quiet period after the last change before a pipeline runs, so bursts run it once
+    'max_delay': 3600,  # Longest a pipeline waits for its inputs to settle before it runs anyway
+    'pipelines': [
+        {'name': 'cratedigger', 'action': 'cratedigger'},
+        {'name': 'clean cratedigger', 'action': 'clean_cratedigger', 'against': ['Airborne', 'Boost', 'Chill']},
+    ],
+}
+
+# Names of the playlists whose changes should trigger the pipeline
+def get_pipeline_inputs(pipeline):
+    action = pipeline['action']
+    if action == 'cratedigger':
+        return ['Discover Weekly']
+    if action == 'clean_cratedigger':
+        return ['CRATEDIGGER'] + pipeline['against']
+    if action in ('dedupe', 'sort'):
+        return [pipeline['playlist']]
+    if action == 'clean':
+        return [pipeline['playlist']] + pipeline['against']
+    raise ValueError(f"Unknown pipeline action: {action!r}")
+
+class SyncDaemon:
+    def __init__(self, sp, config=DEFAULT_CONFIG, state_path=STATE_PATH):
+        self.sp = sp
+        self.config = dict(DEFAULT_CONFIG, **config)
+        self.state_path = state_path
+        self.state = self.load_state()  # pipeline name -> {'inputs', 'seen', 'changed_at', 'first_changed_at', 'last_run'}
+        self.index = LibraryIndex.load()  # Shared by the clean pipelines, refreshed only when something runs
+
+    def load_state(self):
+        try:
+            with open(self.state_path) as state_file:
+                return json.load(state_file)
+        except (OSError, ValueError):
+            return {}
+
+    def save_state(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+        temporary_path = self.state_path + '.tmp'
+        with open(temporary_path, 'w') as state_file:
+            json.dump(self.state, state_file)
+        os.replace(temporary_path, self.state_path)  # Atomic, so a crash never leaves a half-written state
+
+    # Current {playlist_id: snapshot_id} of the pipeline's input playlists
+    def get_input_snapshots(self, pipeline, playlists):
+        names = {name.strip().lower() for name in get_pipeline_inputs(pipeline)}
+        return {playlist['id']: playlist['snapshot_id'] for playlist in playlists if playlist['name'].lower() in names}
+
+    # Polls the snapshots once and runs every pipeline whose inputs changed and have settled
+    # Returns the names of the pipelines that ran
+    def poll(self, now=None):
+        now = time.time() if now is None else now
+        playlists = get_user_playlists(self.sp)  # One call per 50 playlists, however large they are
+        due = []
+        for pipeline in self.config['pipelines']:
+            state = self.state.setdefault(pipeline['name'], {'inputs': None, 'seen': None, 'changed_at': None})
+            current = self.get_input_snapshots(pipeline, playlists)
+            if current != state['seen']:
+                # Every new change restarts the quiet period, coalescing a burst of edits into one run
+                state['seen'] = current
+                if current == state['inputs']:
+                    state['changed_at'] = state['first_changed_at'] = None  # Changed back to what was processed
+                else:
+                    state['changed_at'] = now
+                    state['first_changed_at'] = state.get('first_changed_at') or now
+            if state['changed_at'] is not None and (now - state['changed_at'] >= self.config['settle_time']
+                                                    or now - state['first_changed_at'] >= self.config['max_delay']):
+                due.append(pipeline)
+
+        ran = []
+        for pipeline in due:  # Config order, so earlier pipelines feed later ones
+            try:
+                self.index.refresh(self.sp, playlists)  # Only playlists changed since the last refresh are fetched
+                with tracing.stage(pipeline['name']):
+                    self.run_pipeline(pipeline, playlists)
+            except Exception as error:  # Keeps the daemon alive; the pipeline stays pending and is retried
+                print(f"Pipeline '{pipeline['name']}' failed: {error}")
+                continue
+            ran.append(pipeline['name'])
+            # The pipeline's own writes change its inputs, so record the snapshots it left behind as processed
+            playlists = get_user_playlists(self.sp)
+            state = self.state[pipeline['name']]
+            state['inputs'] = state['seen'] = self.get_input_snapshots(pipeline, playlists)
+            state['changed_at'] = state['first_changed_at'] = None
+            state['last_run'] = now
+        self.save_state()
+        tracing.export()  # Keeps the exported metrics current while the daemon runs
+        return ran
+
+    def run_pipeline(self, pipeline, playlists):
+        action = pipeline['action']
+        print(f"Running pipeline '{pipeline['name']}'...")
+        if action == 'cratedigger':
+            tracks = cratedigger.get_discovery_weekly_tracks(self.sp, playlists)
+            if tracks:
+                cratedigger.add_tracks_to_cratedigger(self.sp, tracks, playlists)
+            return
+        if action == 'clean_cratedigger':
+            clean_cratedigger.clean_cratedigger(self.sp, pipeline['against'], self.index)
+            return
+
+        playlist = next((playlist for playlist in playlists
+                         if playlist['name'].lower() == pipeline['playlist'].strip().lower()), None)
+        if playlist is None:
+            print(f"Playlist '{pipeline['playlist']}' not found.")
+        elif action == 'clean':
+            clean_playlist.clean_playlist(self.sp, playlist['id'], pipeline['against'], self.index)
+        elif action == 'dedupe':
+            true_duplicates.clean_duplicates(self.sp, playlist['id'])
+        elif action == 'sort':
+            sort.sort_playlist(self.sp, playlist['id'], playlist['snapshot_id'], sort.parse_sort_keys(pipeline['sort']))
+
+    # Polls forever, sleeping poll_interval seconds between polls
+    # A failed poll (e.g. a connection error that outlasted the retries) is logged and tried again next time
+    def run_forever(self):
+        while True:
+            try:
+                ran = self.poll()
+            except Exception as error:
+                print(f"Poll failed: {error}")
+                ran = []
+            if ran:
+                print(f"Ran {', '.join(ran)}.")
+            time.sleep(self.config['poll_interval'])
+
+if __name__ == "__main__":
+    config = DEFAULT_CONFIG
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as config_file:
+            config = json.load(config_file)
+    for pipeline in config.get('pipelines', []):
+        get_pipeline_inputs(pipeline)  # Fails early on unknown actions
+
+    sp = authenticate_spotify()  # Has every scope the pipelines need
+    daemon = SyncDaemon(sp, config)
+    print(f"Syncing {len(daemon.config['pipelines'])} pipelines every {daemon.config['poll_interval']} seconds.")
+    try:
+        daemon.run_forever()
+    except KeyboardInterrupt:
+        daemon.save_state()
@@ -0,0 +1,230 @@
+# Request-level tracing of Spotify calls, with a per-run summary by stage
+# Off unless ORPHEUS_TRACE is set; while off, stage() and propagate() return shared no-ops and the client
+# skips tracing entirely, so the only cost is one check per request.
+
+# ORPHEUS_TRACE=1                  prints the summary when the script exits
+# ORPHEUS_TRACE_EXPORT=run.json    also writes every call and the stage totals as JSON
+# ORPHEUS_TRACE_EXPORT=run.prom    ... or as Prometheus text, e.g. for the node_exporter textfile collector
+
+import atexit
+import contextlib
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from urllib.parse import parse_qs, urlparse
+
+TRACE = os.getenv('ORPHEUS_TRACE', '').lower() not in ('', '0', 'false', 'no') or bool(os.getenv('ORPHEUS_TRACE_EXPORT'))
+TRACE_EXPORT = os.getenv('ORPHEUS_TRACE_EXPORT')  # .json for JSON, anything else for Prometheus text
+MAX_CALLS = 100000  # Individual calls kept for the JSON export; stage totals always cover the whole run
+
+ID_SEGMENT = re.compile(r'/[0-9A-Za-z]{22}(?=/|$)')  # Spotify IDs in a URL path
+USER_SEGMENT = re.compile(r'^users/[^/]+')
+NO_STAGE = 'other'  # Stage of calls made outside any stage()
+
+_null_stage = contextlib.nullcontext()
+_local = threading.local()  # Per thread: current stage, plus retries and bytes of the call in progress
+
+# Collects one record per call and running totals per (stage, endpoint, status)
+class Tracer:
+    def __init__(self):
+        self.started = time.time()
+        self.calls = deque(maxlen=MAX_CALLS)
+        self.totals = {}  # (stage, endpoint, status) -> {'calls', 'items', 'seconds', 'max_seconds', 'retries', 'bytes'}
+        self.stage_seconds = {}  # stage -> wall time spent inside it, added up over the threads that entered it
+        self.lock = threading.Lock()
+
+    def record(self, stage, endpoint, status, items, seconds, retries, response_bytes):
+        with self.lock:
+            self.calls.append({'stage': stage, 'endpoint': endpoint, 'status': status, 'items': items,
+                               'seconds': round(seconds, 6), 'retries': retries, 'bytes': response_bytes})
+            totals = self.totals.setdefault((stage, endpoint, status), {'calls': 0, 'items': 0, 'seconds': 0.0,
+                                                                        'max_seconds': 0.0, 'retries': 0, 'bytes': 0})
+            totals['calls'] += 1
+            totals['items'] += items
+            totals['seconds'] += seconds
+            totals['max_seconds'] = max(totals['max_seconds'], seconds)
+            totals['retries'] += retries
+            totals['bytes'] += response_bytes
+
+    def add_stage_time(self, stage, seconds):
+        with self.lock:
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+
+    # Totals per stage: calls, items, seconds spent in calls, wall time, 429s and bytes
+    def stages(self):
+        with self.lock:
+            stages = {stage: {'calls': 0, 'items': 0, 'call_seconds': 0.0, 'wall_seconds': round(seconds, 3),
+                              'throttled': 0, 'bytes': 0} for stage, seconds in self.stage_seconds.items()}
+            for (stage, endpoint, status), totals in self.totals.items():
+                summary = stages.setdefault(stage, {'calls': 0, 'items': 0, 'call_seconds': 0.0, 'wall_seconds': None,
+                                                    'throttled': 0, 'bytes': 0})
+                summary['calls'] += totals['calls']
+                summary['items'] += totals['items']
+                summary['call_seconds'] += totals['seconds']
+                summary['throttled'] += totals['retries'] + (totals['calls'] if status == 429 else 0)
+                summary['bytes'] += totals['bytes']
+        return stages
+
+    def summary(self):
+        stages = self.stages()
+        if not stages:
+            return "No Spotify calls were made."
+        lines = ["Spotify calls by stage:",
+                 f"  {'stage':<36} {'calls':>6} {'items':>7} {'429s':>5} {'MB':>7} {'call s':>8} {'wall s':>8}"]
+        for stage, summary in sorted(stages.items(), key=lambda entry: -entry[1]['call_seconds']):
+            wall = f"{summary['wall_seconds']:.2f}" if summary['wall_seconds'] is not None else '-'
+            lines.append(f"  {stage:<36} {summary['calls']:>6} {summary['items']:>7} {summary['throttled']:>5} "
+                         f"{summary['bytes'] / 1e6:>7.2f} {summary['call_seconds']:>8.2f} {wall:>8}")
+        slowest, slowest_summary = max(stages.items(), key=lambda entry: entry[1]['call_seconds'])
+        throttled = sum(summary['throttled'] for summary in stages.values())
+        lines.append(f"Slowest stage: {slowest} ({slowest_summary['call_seconds']:.2f}s waiting on Spotify). "
+                     f"{throttled} requests were rate limited (429).")
+        return '\n'.join(lines)
+
+    def to_json(self):
+        with self.lock:
+            calls = list(self.calls)
+        return {'started': self.started, 'seconds': round(time.time() - self.started, 3), 'stages': self.stages(),
+                'calls': calls}
+
+    def to_prometheus(self):
+        with self.lock:
+            totals = dict(self.totals)
+            stage_seconds = dict(self.stage_seconds)
+        metrics = [
+            ('orpheus_spotify_requests_total', 'counter', 'Spotify API calls', 'calls'),
+            ('orpheus_spotify_request_seconds_total', 'counter', 'Time spent in Spotify API calls, retries included', 'seconds'),
+            ('orpheus_spotify_request_max_seconds', 'gauge', 'Slowest single Spotify API call', 'max_seconds'),
+            ('orpheus_spotify_batch_items_total', 'counter', 'Tracks, IDs or items sent or received', 'items'),
+            ('orpheus_spotify_retries_total', 'counter', 'Retries after a 429 response', 'retries'),
+            ('orpheus_spotify_response_bytes_total', 'counter', 'Bytes of Spotify API responses', 'bytes'),
+        ]
+        lines = []
+        for name, kind, description, field in metrics:
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+            for (stage, endpoint, status), values in sorted(totals.items(), key=lambda entry: tuple(map(str, entry[0]))):
+                labels = f'stage="{label(stage)}",endpoint="{label(endpoint)}",status="{status}"'
+                lines.append(f"{name}{{{labels}}} {values[field]:g}")
+        lines += ["# HELP orpheus_stage_seconds_total Wall time spent in each stage",
+                  "# TYPE orpheus_stage_seconds_total counter"]
+        lines += [f'orpheus_stage_seconds_total{{stage="{label(stage)}"}} {seconds:g}' for stage, seconds in sorted(stage_seconds.items())]
+        return '\n'.join(lines) + '\n'
+
+def label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+_tracer = Tracer() if TRACE else None
+
+def is_enabled():
+    return _tracer is not None
+
+def get_tracer():
+    return _tracer
+
+def current_stage():
+    return getattr(_local, 'stage', None) or NO_STAGE
+
+@contextlib.contextmanager
+def _traced_stage(name):
+    parent = getattr(_local, 'stage', None)
+    _local.stage = f"{parent}/{name}" if parent else name  # Nested stages read like "clean cratedigger/remove tracks"
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _tracer.add_stage_time(_local.stage, time.perf_counter() - started)
+        _local.stage = parent
+
+# Context manager that attributes the calls made inside it (and in threads started through propagate) to a stage
+def stage(name):
+    if _tracer is None:
+        return _null_stage
+    return _traced_stage(name)
+
+# Wraps a function handed to a thread pool so its calls count towards the stage of the submitting thread
+def propagate(func):
+    if _tracer is None:
+        return func
+    submitted_stage = getattr(_local, 'stage', None)
+    def run(*args, **kwargs):
+        previous = getattr(_local, 'stage', None)
+        _local.stage = submitted_stage
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.stage = previous
+    return run
+
+# "GET playlists/{id}/tracks" from a request URL
+def endpoint_name(method, url):
+    path = urlparse(url).path
+    path = path.split('/v1/', 1)[-1].strip('/')
+    path = USER_SEGMENT.sub('users/{id}', path)
+    return f"{method} {ID_SEGMENT.sub('/{id}', '/' + path)[1:]}"
+
+# Number of tracks, IDs or items a call sent (writes, audio features) or received (pages)
+def batch_size(url, payload, params, result):
+    ids = (params or {}).get('ids') or parse_qs(urlparse(url).query).get('ids', [None])[0]
+    if ids:
+        return len(str(ids).split(','))
+    if isinstance(payload, list):
+        return len(payload)
+    if isinstance(payload, dict):
+        if isinstance(payload.get('tracks'), list):
+            return sum(len(track.get('positions', [None])) for track in payload['tracks'])
+        if isinstance(payload.get('uris'), list):
+            return len(payload['uris'])
+        if 'range_length' in payload:
+            return payload['range_length']
+    if isinstance(result, dict) and isinstance(result.get('items'), list):
+        return len(result['items'])
+    return 1
+
+# Called by the client for every 429 it retries
+def note_retry():
+    if _tracer is not None:
+        _local.retries = getattr(_local, 'retries', 0) + 1
+
+# requests response hook counting response bytes towards the call in progress
+def count_response_bytes(response, *args, **kwargs):
+    _local.response_bytes = getattr(_local, 'response_bytes', 0) + len(response.content or b'')
+
+# Runs call(method, url, payload, params) and records it
+def trace_call(call, method, url, payload, params):
+    _local.retries = _local.response_bytes = 0
+    status, result = 200, None
+    started = time.perf_counter()
+    try:
+        result = call(method, url, payload, params)
+        return result
+    except Exception as error:
+        status = getattr(error, 'http_status', None) or 'error'
+        raise
+    finally:
+        _tracer.record(current_stage(), endpoint_name(method, url), status, batch_size(url, payload, params, result),
+                       time.perf_counter() - started, _local.retries, _local.response_bytes)
+
+# Writes the configured export file, if any; safe to call repeatedly (e.g. after every daemon poll)
+def export(path=TRACE_EXPORT):
+    if _tracer is None or not path:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w') as export_file:
+        if path.endswith('.json'):
+            json.dump(_tracer.to_json(), export_file)
+        else:
+            export_file.write(_tracer.to_prometheus())
+    os.replace(temporary_path, path)  # Scrapers never see a half-written file
+
+def report():
+    if _tracer is None:
+        return
+    print(_tracer.summary())
+    export()
+
+if _tracer is not None:
+    atexit.register(report)
@@ -0,0 +1,51 @@
+# Compact in-memory record of a playlist track, built from each page as it arrives
+# The raw API items carry album art, market lists and external URLs the scripts never read
+
+import sys
+
+# Only the fields the Track record needs, requested through the `fields` parameter to shrink every page
+# (total and limit are what the concurrent pagination needs to plan the remaining pages)
+TRACK_FIELDS = 'items(track(id,uri,name,artists(name),duration_ms,external_ids(isrc),popularity)),total,limit'
+
+class Track:
+    __slots__ = ('id', 'uri', 'name', 'artist', 'duration_ms', 'isrc', 'popularity')
+
+    def __init__(self, id=None, uri=None, name=None, artist=None, duration_ms=None, isrc=None, popularity=None):
+        self.id = id  # None for local files and unavailable tracks
+        self.uri = uri  # None only for unavailable tracks
+        self.name = name
+        self.artist = artist  # Primary artist's name, interned since artists repeat across a library
+        self.duration_ms = duration_ms
+        self.isrc = isrc
+        self.popularity = popularity
+
+    # Builds a Track from a playlist_tracks item
+    # Unavailable tracks (item['track'] is None) give an empty record, so playlist positions stay aligned
+    @classmethod
+    def from_item(cls, item):
+        track = item.get('track')
+        if not track:
+            return cls()
+        artists = track.get('artists') or []
+        artist = artists[0].get('name') if artists else None
+        return cls(track.get('id'), track.get('uri'), track.get('name'), sys.intern(artist) if artist else artist,
+                   track.get('duration_ms'), (track.get('external_ids') or {}).get('isrc'), track.get('popularity'))
+
+    # Flat list form used to store tracks as JSON, e.g. in the Redis cache
+    def to_row(self):
+        return [self.id, self.uri, self.name, self.artist, self.duration_ms, self.isrc, self.popularity]
+
+    @classmethod
+    def from_row(cls, row):
+        track = cls(*row)
+        if track.artist:
+            track.artist = sys.intern(track.artist)
+        return track
+
+    def __repr__(self):
+        return f"Track({self.name!r} - {self.artist!r}, {self.uri!r})"
+
+# Replaces the raw items of a playlist_tracks page with Track records and returns the page
+def compact_page(page):
+    page['items'] = [Track.from_item(item) for item in page['items']]
+    return page